@@ -0,0 +1,410 @@
+"""     _               _____                _ _
+       | |        /\   / ____|              | (_)
+  _ __ | |       /  \ | |     __ _ _   _  __| |_  ___
+ | '_ \| |      / /\ \| |    / _` | | | |/ _` | |/ _ \
+ | |_) | |____ / ____ \ |___| (_| | |_| | (_| | | (_) |
+ | .__/|______/_/    \_\_____\__,_|\__,_|\__,_|_|\___/
+ | |
+ |_|
+
+This file is part of pLAC-audio.
+
+pLAC-audio is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pLAC-audio is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pLAC-audio.  If not, see <http://www.gnu.org/licenses/>
+
+Copyright (c) 2019 Fabrice Zaoui
+
+License GNU GPL v3
+
+Conversion on several hosts: the coordinator owns the queue of jobs built by the scan and hands
+them to the workers that connect to it (TCP, one JSON object per line). Each worker converts with
+the same engine as the local threads and reports its results; the manifests stay on the coordinator.
+The hosts must see the lossless and output folders at the same paths (e.g. same NFS mount point).
+No authentication: to be used on a trusted network only.
+"""
+import os
+import json
+import socket
+import logging
+import threading
+import socketserver
+from engine import Converter, probeJob, audioDuration
+from encoder import Target
+from cueSheet import Track, parseCue
+from dedupe import Dedupe
+from launcher import CancelToken
+
+VERSION = 1
+HEARTBEAT = 5.0  # seconds between two messages of a busy worker
+TIMEOUT = 3 * HEARTBEAT  # a worker silent for longer is dead: its job is given to another one
+
+
+def parseAddress(text, host=''):
+    # [HOST:]PORT
+    if ':' in text:
+        host, text = text.rsplit(':', 1)
+    return host, int(text)
+
+
+def send(sock, lock, message):
+    data = (json.dumps(message) + '\n').encode('utf-8')
+    with lock:
+        sock.sendall(data)
+
+
+def receive(reader):
+    line = reader.readline()
+    if not line:
+        raise ConnectionError('connection closed')
+    return json.loads(line.decode('utf-8'))
+
+
+def encodeJob(job):
+    if isinstance(job, Track):
+        return {'cue': job.sheet.cue, 'track': job.number}
+    return {'path': job}
+
+
+def decodeJob(data, sheets):
+    # the CUE sheets are parsed again by the worker (once for all their tracks)
+    if 'path' in data:
+        return data['path']
+    cue = data['cue']
+    if cue not in sheets:
+        try:
+            names = [name for name in os.listdir(os.path.dirname(cue)) if not name.startswith('.')]
+        except OSError:
+            names = []
+        sheets[cue] = parseCue(cue, names)
+    if sheets[cue] is not None:
+        for track in sheets[cue].tracks:
+            if track.number == data['track']:
+                return track
+    return None
+
+
+class Handler(socketserver.BaseRequestHandler):
+    # one connection of a worker (one conversion at a time)
+    def handle(self):
+        coordinator = self.server.coordinator
+        self.request.settimeout(TIMEOUT)
+        lock = threading.Lock()
+        reader = self.request.makefile('rb')
+        name = '%s:%d' % self.client_address
+        job = None
+        temps = set()
+        try:
+            hello = receive(reader)
+            if hello.get('type') != 'hello' or hello.get('version') != VERSION:
+                logging.error('Unknown worker protocol: ' + name)
+                return
+            name = str(hello.get('name', name)) + '/' + str(hello.get('slot', 0))
+            send(self.request, lock, coordinator.config())
+            logging.info('Worker connected: ' + name)
+            while True:
+                message = receive(reader)
+                if message['type'] == 'heartbeat':
+                    continue
+                if message['type'] == 'get' and job is None:
+                    job = coordinator.get(remote=True)
+                    if job is None:
+                        send(self.request, lock, {'type': 'end'})
+                        break
+                    send(self.request, lock, {'type': 'job', 'job': encodeJob(job)})
+                elif message['type'] == 'manifest' and job is not None:
+                    value = coordinator.manifest(message, temps)
+                    send(self.request, lock, {'type': 'result', 'value': value})
+                elif message['type'] == 'done' and job is not None:
+                    coordinator.finish(job, message, name)
+                    job = None
+                    temps.clear()
+                    send(self.request, lock, {'type': 'ok'})
+                else:
+                    logging.error('Unexpected message from the worker ' + name + ': ' + message['type'])
+                    break
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning('Worker lost: ' + name + ' (' + str(e) + ')')
+        finally:
+            if job is not None:
+                # its partial outputs are removed and the job is converted by another worker
+                for target, temp in temps:
+                    coordinator.converter.targets[target].manifest.abort(temp)
+                logging.info('Job given back to the queue: ' + str(job))
+                coordinator.release(job)
+            reader.close()
+
+
+class Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class Coordinator:
+    def __init__(self, jobs, converter, address, callback=None):
+        self.jobs = jobs
+        self.converter = converter
+        self.callback = callback
+        self.cond = threading.Condition()
+        self.inflight = 0  # jobs in the hands of the remote workers
+        self.server = Server(address, Handler)
+        self.server.coordinator = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        logging.info('Coordinator waiting for the workers on port ' + str(self.server.server_address[1]))
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def config(self):
+        return {'type': 'config', 'lossless_folder': self.converter.lossless_folder,
+                'samplerate': self.converter.samplerate, 'channels': self.converter.channels,
+                'targets': [[target.codec, target.qval, target.lossy_location] for target in self.converter.targets]}
+
+    # queue of the local threads (convertFiles) and of the remote workers: it is done only when the
+    # remote jobs are finished too (a job of a dead worker goes back to the queue)
+    def put(self, job, weight=0, first=False):
+        self.jobs.put(job, weight, first)
+
+    def isDone(self):
+        with self.cond:
+            return self.inflight == 0 and self.jobs.isDone()
+
+    def get(self, remote=False):
+        while not self.converter.cancel.isCancelled():
+            if remote:
+                # counted before being taken: no one can see the queue done in between
+                with self.cond:
+                    self.inflight += 1
+            job = self.jobs.get()
+            if job is not None:
+                return job
+            if remote:
+                self.release()
+            with self.cond:
+                while self.inflight > 0 and self.jobs.isDone() and not self.converter.cancel.isCancelled():
+                    self.cond.wait(1.0)
+                if self.jobs.isDone():
+                    return None
+        return None
+
+    def release(self, job=None):
+        # end of a remote job ('job' given back to the queue if not done)
+        if job is not None:
+            self.jobs.put(job, first=True)
+        with self.cond:
+            self.inflight -= 1
+            self.cond.notify_all()
+
+    def wait(self):
+        # remote jobs still running
+        with self.cond:
+            while not self.converter.cancel.isStopped() and (self.inflight > 0 or not (
+                    self.jobs.isDone() or self.converter.cancel.isCancelled())):
+                self.cond.wait(1.0)
+
+    def manifest(self, message, temps):
+        # manifest calls of a worker (temporary files only in the output folders)
+        target = int(message['target'])
+        manifest = self.converter.targets[target].manifest
+        args = message['args']
+        if message['call'] == 'isDone':
+            return manifest.isDone(*args[:3])
+        if message['call'] == 'isKnown':
+            return manifest.isKnown(*args[:1])
+        temp = args[-1]
+        if temp is not None and not self.isTemp(target, temp):
+            raise ValueError('not a temporary file: ' + str(temp))
+        if message['call'] == 'begin':
+            temps.add((target, temp))
+            manifest.begin(temp)
+        elif message['call'] == 'abort':
+            temps.discard((target, temp))
+            manifest.abort(temp)
+        elif message['call'] == 'add':
+            temps.discard((target, temp))
+            manifest.add(*args[:5])
+        return None
+
+    def isTemp(self, target, temp):
+        folder = os.path.abspath(self.converter.targets[target].lossy_location)
+        name = os.path.basename(temp)
+        return os.path.abspath(temp).startswith(folder + os.sep) and name.startswith('.') and '.part.' in name
+
+    def finish(self, job, message, name):
+        status = message['status']
+        if status == 'cancelled':
+            # stopped on the worker side: converted by another one
+            self.release(job)
+            return
+        seconds = 0.0
+        for record in message['records']:
+            record['worker'] = name
+            seconds = max(seconds, record.get('duration', 0.0))
+            self.converter.telemetry.record(**record)
+        for audio_file_in, ret, errors in message['failures']:
+            self.converter.fail(audio_file_in, ret, errors)
+        if isinstance(job, Track):
+            size = job.size
+        else:
+            try:
+                size = os.path.getsize(job)
+            except OSError:
+                size = 0
+        if status == 'skipped' and self.converter.probes is not None:
+            # duration counted by the scan (probe cache)
+            seconds = audioDuration(job, probeJob(job, self.converter.probes))
+        self.converter.count(status, size, seconds)
+        self.release()
+        if self.callback is not None:
+            self.callback(str(job), status)
+
+
+# connection of a worker slot to the coordinator
+class Client:
+    def __init__(self, address, cancel):
+        self.sock = socket.create_connection(address)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.reader = self.sock.makefile('rb')
+        self.lock = threading.Lock()
+        self.cancel = cancel
+        self.closed = threading.Event()
+        threading.Thread(target=self.heartbeat, daemon=True).start()
+
+    def call(self, message):
+        send(self.sock, self.lock, message)
+        return receive(self.reader)
+
+    def heartbeat(self):
+        # the coordinator knows the worker is alive during a long conversion
+        while not self.closed.wait(HEARTBEAT):
+            try:
+                send(self.sock, self.lock, {'type': 'heartbeat'})
+            except OSError:
+                # coordinator gone: the results could not be reported
+                if not self.closed.is_set():
+                    logging.error('Connection to the coordinator lost')
+                    self.cancel.cancel()
+                return
+
+    def close(self):
+        self.closed.set()
+        self.reader.close()
+        self.sock.close()
+
+
+# manifest of a target kept by the coordinator
+class RemoteManifest:
+    def __init__(self, client, target):
+        self.client = client
+        self.target = target
+
+    def call(self, name, *args):
+        reply = self.client.call({'type': 'manifest', 'target': self.target, 'call': name, 'args': list(args)})
+        return reply.get('value')
+
+    def cleanup(self):
+        return 0
+
+    def begin(self, temp):
+        self.call('begin', temp)
+
+    def abort(self, temp):
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+        self.call('abort', temp)
+
+    def isDone(self, source, size, mtime):
+        return self.call('isDone', source, size, mtime)
+
+    def isKnown(self, source):
+        return self.call('isKnown', source)
+
+    def add(self, source, size, mtime, output, temp=None):
+        self.call('add', source, size, mtime, output, temp)
+
+    def close(self):
+        pass
+
+
+class Worker:
+    # 'nslots' conversions in parallel, each one with its own connection to the coordinator
+    def __init__(self, address, nslots, probes=None):
+        self.address = address
+        self.nslots = nslots
+        self.name = socket.gethostname()
+        self.cancel = CancelToken()
+        self.dedupe = Dedupe()
+        self.probes = probes
+        self.lock = threading.Lock()
+        self.stats = {'converted': 0, 'skipped': 0, 'failed': 0, 'cancelled': 0}
+        self.connected = 0
+
+    def run(self):
+        threads = [threading.Thread(target=self.slot, args=(i,)) for i in range(self.nslots)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.stats
+
+    def slot(self, worker):
+        try:
+            client = Client(self.address, self.cancel)
+        except OSError as e:
+            logging.error('Unable to connect to the coordinator: ' + str(e))
+            return
+        try:
+            config = client.call({'type': 'hello', 'version': VERSION, 'name': self.name, 'slot': worker})
+            with self.lock:
+                self.connected += 1
+            targets = []
+            for k, (codec, qvalue, lossy_location) in enumerate(config['targets']):
+                target = Target(codec, qvalue, lossy_location)
+                target.manifest = RemoteManifest(client, k)
+                targets.append(target)
+            converter = Converter(targets, config['lossless_folder'], config['samplerate'], config['channels'])
+            converter.cancel = self.cancel
+            converter.dedupe = self.dedupe
+            converter.probes = self.probes
+            sheets = {}
+            while not self.cancel.isCancelled():
+                reply = client.call({'type': 'get'})
+                if reply['type'] != 'job':
+                    break
+                job = decodeJob(reply['job'], sheets)
+                if job is None:
+                    converter.fail(str(reply['job']), -1, ['CUE track not found'])
+                    status = converter.count('failed')
+                else:
+                    try:
+                        status = converter.convert2lossy(job, worker)
+                    except OSError:
+                        raise  # connection to the coordinator (remote manifest)
+                    except Exception:
+                        status = converter.crash(str(job))
+                logging.info(status.capitalize() + ': ' + str(job))
+                with self.lock:
+                    self.stats[status] += 1
+                # the records of this job only (one converter per connection)
+                records, converter.telemetry.records = converter.telemetry.records, []
+                failures, converter.failures = converter.failures, []
+                client.call({'type': 'done', 'status': status, 'records': records, 'failures': failures})
+        except (OSError, ValueError, KeyError) as e:
+            logging.error('Connection to the coordinator lost: ' + str(e))
+        finally:
+            client.close()
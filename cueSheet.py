@@ -0,0 +1,210 @@
+"""     _               _____                _ _
+       | |        /\   / ____|              | (_)
+  _ __ | |       /  \ | |     __ _ _   _  __| |_  ___
+ | '_ \| |      / /\ \| |    / _` | | | |/ _` | |/ _ \
+ | |_) | |____ / ____ \ |___| (_| | |_| | (_| | | (_) |
+ | .__/|______/_/    \_\_____\__,_|\__,_|\__,_|_|\___/
+ | |
+ |_|
+
+This file is part of pLAC-audio.
+
+pLAC-audio is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pLAC-audio is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pLAC-audio.  If not, see <http://www.gnu.org/licenses/>
+
+Copyright (c) 2019 Fabrice Zaoui
+
+License GNU GPL v3
+"""
+import os
+import re
+import threading
+from launcher import probe
+
+COMMAND = re.compile(r'^\s*(\w+)\s+(.*?)\s*$')
+# characters not allowed in the names of the track files
+FORBIDDEN = re.compile(r'[\\/:*?"<>|]')
+# extensions of the album images
+IMAGES = ('.flac', '.ape', '.wav', '.aif', '.aiff', '.m4a')
+
+
+def unquote(text):
+    if len(text) >= 2 and text[0] == '"' and text[-1] == '"':
+        return text[1:-1]
+    return text
+
+
+def readCue(path):
+    # the CUE sheets are often not written in UTF-8
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        return data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return data.decode('cp1252', 'replace')
+
+
+# album image (one audio file for a whole disc) and the tracks described by its CUE sheet
+class CueSheet:
+    def __init__(self, cue, image):
+        self.cue = cue
+        self.image = image
+        self.title = ''
+        self.performer = ''
+        self.tracks = []
+        self.info = None
+        self.probed = False
+        self.lock = threading.Lock()
+
+    def probe(self, probes=None):
+        # the image is probed once for all its tracks ('probes': cache of the results)
+        with self.lock:
+            if not self.probed:
+                self.info = probe(self.image) if probes is None else probes.probe(self.image)
+                self.probed = True
+        return self.info
+
+    def sampleRate(self):
+        info = self.probe()
+        return None if info is None else info['sample_rate']
+
+
+# one track of an album image: converted as a job of its own
+class Track:
+    def __init__(self, sheet, number):
+        self.sheet = sheet
+        self.number = number
+        self.title = ''
+        self.performer = ''
+        self.start = None  # CUE frames (1/75 s)
+        self.end = None  # None for the last track
+        self.size = 0  # share of the image size
+
+    def __str__(self):
+        return self.sheet.image + ' [track %02d]' % self.number
+
+    def duration(self):
+        # seconds (None if the length of the image is unknown for the last track)
+        if self.end is not None:
+            return (self.end - self.start) / 75.0
+        if self.sheet.info is None:
+            return None
+        return max(0.0, self.sheet.info['duration'] - self.start / 75.0)
+
+    def fileName(self):
+        if self.title == '':
+            return '%02d' % self.number
+        return '%02d - ' % self.number + FORBIDDEN.sub('_', self.title)
+
+    def trimArgs(self):
+        # input and output arguments: the image is read from a whole second before the track
+        # (exact position in samples) and the track is cut at the sample with atrim
+        rate = self.sheet.sampleRate()
+        if rate is None:
+            args = ['-ss', '%.6f' % (self.start / 75.0)]
+            if self.end is not None:
+                args += ['-to', '%.6f' % (self.end / 75.0)]
+            return args, []
+        seek = max(0, self.start // 75 - 1)
+        trim = 'atrim=start_sample=' + str(self.start * rate // 75 - seek * rate)
+        if self.end is not None:
+            trim += ':end_sample=' + str(self.end * rate // 75 - seek * rate)
+        return ['-ss', str(seek)], ['-af', trim]
+
+    def metadata(self):
+        # tags of the track (the other tags are copied from the image), no chapters of the whole disc
+        args = ['-map_chapters', '-1', '-metadata', 'track=' + str(self.number) + '/' + str(len(self.sheet.tracks))]
+        if self.title != '':
+            args += ['-metadata', 'title=' + self.title]
+        if self.performer != '' or self.sheet.performer != '':
+            args += ['-metadata', 'artist=' + (self.performer or self.sheet.performer)]
+        if self.sheet.title != '':
+            args += ['-metadata', 'album=' + self.sheet.title]
+        if self.sheet.performer != '':
+            args += ['-metadata', 'album_artist=' + self.sheet.performer]
+        return args
+
+
+def findImage(name, names):
+    # the extension in the sheet is often the one of the ripped file (WAV) and not the one of the image
+    if name in names:
+        return name
+    stem = os.path.splitext(name)[0]
+    for other in names:
+        if os.path.splitext(other)[0] == stem and other.lower().endswith(IMAGES):
+            return other
+    return None
+
+
+def parseCue(path, names):
+    # CUE sheet of a single album image of the same folder ('names': files of the folder)
+    # None if the sheet describes several files (tracks already separated) or cannot be read
+    try:
+        text = readCue(path)
+    except OSError:
+        return None
+    title = performer = ''
+    sheet = None
+    track = None
+    for line in text.splitlines():
+        match = COMMAND.match(line)
+        if match is None:
+            continue
+        command = match.group(1).upper()
+        value = match.group(2)
+        if command == 'FILE':
+            if sheet is not None:
+                return None
+            # FILE "name" TYPE
+            if value.startswith('"'):
+                value = value[1:value.rfind('"')]
+            else:
+                value = value.rsplit(None, 1)[0]
+            image = findImage(os.path.basename(value.replace('\\', '/')), names)
+            if image is None:
+                return None
+            sheet = CueSheet(path, os.path.join(os.path.dirname(path), image))
+            sheet.title = title
+            sheet.performer = performer
+        elif command == 'TRACK':
+            if sheet is None:
+                return None
+            try:
+                track = Track(sheet, int(value.split()[0]))
+            except (ValueError, IndexError):
+                return None
+            sheet.tracks.append(track)
+        elif command == 'INDEX' and track is not None:
+            fields = value.split()
+            try:
+                if len(fields) == 2 and int(fields[0]) == 1:
+                    mm, ss, ff = [int(x) for x in fields[1].split(':')]
+                    track.start = (mm * 60 + ss) * 75 + ff
+            except ValueError:
+                return None
+        elif command in ['TITLE', 'PERFORMER']:
+            value = unquote(value)
+            if track is not None:
+                setattr(track, command.lower(), value)
+            elif sheet is not None:
+                setattr(sheet, command.lower(), value)
+            elif command == 'TITLE':
+                title = value
+            else:
+                performer = value
+    if sheet is None or len(sheet.tracks) == 0 or any(track.start is None for track in sheet.tracks):
+        return None
+    sheet.tracks.sort(key=lambda track: track.start)
+    for track, following in zip(sheet.tracks, sheet.tracks[1:]):
+        track.end = following.start
+    return sheet
@@ -0,0 +1,163 @@
+"""     _               _____                _ _
+       | |        /\   / ____|              | (_)
+  _ __ | |       /  \ | |     __ _ _   _  __| |_  ___
+ | '_ \| |      / /\ \| |    / _` | | | |/ _` | |/ _ \
+ | |_) | |____ / ____ \ |___| (_| | |_| | (_| | | (_) |
+ | .__/|______/_/    \_\_____\__,_|\__,_|\__,_|_|\___/
+ | |
+ |_|
+
+This file is part of pLAC-audio.
+
+pLAC-audio is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pLAC-audio is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pLAC-audio.  If not, see <http://www.gnu.org/licenses/>
+
+Copyright (c) 2019 Fabrice Zaoui
+
+License GNU GPL v3
+"""
+import struct
+import hashlib
+import threading
+
+
+def flacFingerprint(f):
+    # STREAMINFO block: sample rate, channels, bits, number of samples and MD5 of the decoded audio
+    if f.read(4) != b'fLaC':
+        return None
+    header = f.read(4)
+    if len(header) != 4 or header[0] & 0x7f != 0:
+        return None
+    streaminfo = f.read(34)
+    if len(streaminfo) != 34 or streaminfo[18:] == bytes(16):
+        # MD5 not computed by the encoder
+        return None
+    return 'flac:' + streaminfo[10:].hex()
+
+
+# blocks of the samples read for the fingerprint of a WAV/AIFF file (about 1 MB whatever its size)
+SAMPLED_BLOCKS = 16
+SAMPLED_SIZE = 1 << 16
+
+
+def chunkFingerprint(f, fmt, data, endian, full=False):
+    # hash of the format chunk and of the samples (the tags are in other chunks)
+    # only a few blocks spread over the samples unless 'full' (the two files of a match are compared
+    # in full before the copy: the whole file is read only for the likely duplicates)
+    h = hashlib.md5()
+    found = set()
+    f.seek(12)
+    while len(found) < 2:
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        name = header[:4]
+        size = struct.unpack(endian + 'I', header[4:])[0]
+        if name in (fmt, data) and name not in found:
+            h.update(name + header[4:])
+            start = f.tell()
+            if name == data and not full and size > SAMPLED_BLOCKS * SAMPLED_SIZE:
+                step = (size - SAMPLED_SIZE) // (SAMPLED_BLOCKS - 1)
+                for i in range(SAMPLED_BLOCKS):
+                    f.seek(start + i * step)
+                    block = f.read(SAMPLED_SIZE)
+                    if len(block) < SAMPLED_SIZE:
+                        return None
+                    h.update(block)
+                f.seek(start + size)
+            else:
+                remaining = size
+                while remaining > 0:
+                    block = f.read(min(remaining, 1 << 20))
+                    if not block:
+                        return None
+                    h.update(block)
+                    remaining -= len(block)
+            found.add(name)
+        else:
+            f.seek(size, 1)
+        # chunks are padded to an even size
+        if size % 2:
+            f.seek(1, 1)
+    return 'pcm:' + h.hexdigest()
+
+
+def audioFingerprint(path, full=False):
+    # identifier of the audio content (the same for two files with different tags)
+    # None for the formats without a cheap fingerprint
+    try:
+        with open(path, 'rb') as f:
+            magic = f.read(12)
+            f.seek(0)
+            if magic[:4] == b'fLaC':
+                return flacFingerprint(f)
+            if magic[:4] == b'RIFF' and magic[8:12] == b'WAVE':
+                return chunkFingerprint(f, b'fmt ', b'data', '<', full)
+            if magic[:4] == b'FORM' and magic[8:12] in (b'AIFF', b'AIFC'):
+                return chunkFingerprint(f, b'COMM', b'SSND', '>', full)
+    except (OSError, struct.error):
+        pass
+    return None
+
+
+def sameAudio(fingerprint, path, other):
+    # check of a match before the copy: the MD5 of FLAC covers all the audio, the sampled
+    # WAV/AIFF fingerprints are compared again on all the samples
+    if not fingerprint.startswith('pcm:'):
+        return True
+    full = audioFingerprint(path, True)
+    return full is not None and full == audioFingerprint(other, True)
+
+
+# sources with the same audio content found in the run
+class Group:
+    def __init__(self):
+        self.event = threading.Event()
+        self.source = None
+        self.outputs = {}  # output file of each target written for the first source
+        self.deferred = []  # (job, queue) of the copies found before the first source was done
+
+
+# claim of a copy put back in the queue until the first source is done
+DEFERRED = Group()
+
+
+class Dedupe:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.groups = {}
+
+    def claim(self, fingerprint, job=None, jobs=None):
+        # None for the first source with this audio (it is converted), else the group to copy from
+        # DEFERRED if the first source is still in progress: 'job' goes back to 'jobs' once it is done
+        # (without a queue, the caller waits for the group)
+        with self.lock:
+            group = self.groups.get(fingerprint)
+            if group is None:
+                self.groups[fingerprint] = Group()
+                return None
+            if jobs is not None and not group.event.is_set():
+                group.deferred.append((job, jobs))
+                return DEFERRED
+            return group
+
+    def publish(self, fingerprint, source, outputs):
+        with self.lock:
+            group = self.groups[fingerprint]
+            group.source = source
+            group.outputs = outputs
+            group.event.set()
+            deferred = group.deferred
+            group.deferred = []
+        for job, jobs in deferred:
+            jobs.put(job, first=True)
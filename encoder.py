@@ -0,0 +1,126 @@
+"""     _               _____                _ _
+       | |        /\   / ____|              | (_)
+  _ __ | |       /  \ | |     __ _ _   _  __| |_  ___
+ | '_ \| |      / /\ \| |    / _` | | | |/ _` | |/ _ \
+ | |_) | |____ / ____ \ |___| (_| | |_| | (_| | | (_) |
+ | .__/|______/_/    \_\_____\__,_|\__,_|\__,_|_|\___/
+ | |
+ |_|
+
+This file is part of pLAC-audio.
+
+pLAC-audio is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pLAC-audio is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pLAC-audio.  If not, see <http://www.gnu.org/licenses/>
+
+Copyright (c) 2019 Fabrice Zaoui
+
+License GNU GPL v3
+"""
+import re
+from manifest import settingsKey
+
+# quality values of the output formats (ffmpeg value and description)
+QVAL = {'MP3':{'Low':['9', 'VBR 45-85 kbit/s'], 'Medium':['5', 'VBR 120-150 kbit/s'], 'High':['0', 'VBR 220-260 kbit/s']},
+        'AAC':{'Low':['64k', 'CBR 64 kbit/s'], 'Medium':['128k', 'CBR 128 kbit/s'], 'High':['256k', 'CBR 256 kbit/s']},
+        'Ogg Vorbis':{'Low':['0', 'VBR 64 kbit/s'], 'Medium':['5', 'VBR 160 kbit/s'], 'High':['10', 'VBR 500 kbit/s']},
+        'Opus':{'Low':['32k', 'CBR 32 kbit/s'], 'Medium':['64k', 'CBR 64 kbit/s'], 'High':['128k', 'CBR 128 kbit/s']},
+        'FLAC':{'Low':['0', 'Compression Level: 0'], 'Medium':['5', 'Compression Level: 5'], 'High':['12', 'Compression Level: 12']},
+        'ALAC':{'Low':['0', 'Compression Level: 0'], 'Medium':['1', 'Compression Level: 1'], 'High':['2', 'Compression Level:2']},
+        'WAV': {'Low': ['0', 'No Compression'], 'Medium': ['0', 'No Compression'], 'High': ['0', 'No Compression']},
+        'AIFF': {'Low': ['0', 'No Compression'],'Medium': ['0', 'No Compression'], 'High': ['0', 'No Compression']}}
+
+# user-defined sample rates for the DSF conversion to lossless formats
+SAMPLERATES = {1: '44100', 2: '88200', 3: '176400', 4: '352800'}
+
+# byte order of the PCM samples in the WAV and AIFF containers
+PCM_ORDER = {'WAV': 'le', 'AIFF': 'be'}
+PCM = re.compile(r'^pcm_[sf]\d+(le|be)$')
+
+
+# one destination of the conversion: format, quality value and output folder
+class Target:
+    def __init__(self, codec, qvalue, lossy_location):
+        self.codec = codec
+        self.qval = qvalue
+        self.lossy_location = lossy_location
+        self.manifest = None
+
+    def __str__(self):
+        return self.codec + ' (' + self.qval + ') -> ' + self.lossy_location
+
+    def settings(self, samplerate, channels):
+        return settingsKey(self.codec, self.qval, samplerate, channels)
+
+
+def outputOptions(codec, qvalue, file_name_ext, samplerate, channels):
+    # file extension and ffmpeg arguments of an output
+    chn = ['-ac', str(channels)]
+    fe = []
+    if file_name_ext == '.dsf':
+        if codec == 'Ogg Vorbis':
+            fe = ['-ar', '44100']
+        elif codec in ['FLAC', 'ALAC', 'WAV', 'AIFF'] and samplerate in SAMPLERATES:
+            fe = ['-ar', SAMPLERATES[samplerate]]
+    if codec == 'MP3':
+        ext = 'mp3'
+        opts = ['-acodec', 'libmp3lame', '-q:a', qvalue, '-map_metadata', '0', '-id3v2_version', '3']
+    elif codec == 'AAC':
+        ext = 'm4a'
+        opts = ['-acodec', 'aac', '-b:a', qvalue, '-map_metadata', '0']
+    elif codec == 'Ogg Vorbis':
+        ext = 'ogg'
+        opts = ['-acodec', 'libvorbis', '-q:a', qvalue, '-map_metadata', '0']
+    elif codec == 'Opus':
+        ext = 'opus'
+        opts = ['-acodec', 'libopus', '-b:a', qvalue, '-map_metadata', '0']
+    elif codec == 'FLAC':
+        ext = 'flac'
+        opts = ['-compression_level', qvalue, '-map_metadata', '0']
+    elif codec == 'ALAC':
+        ext = 'm4a'
+        opts = ['-acodec', 'alac', '-compression_level', qvalue, '-map_metadata', '0']
+    elif codec == 'WAV':
+        ext = 'wav'
+        opts = ['-map_metadata', '0']
+    elif codec == 'AIFF':
+        ext = 'aif'
+        opts = ['-map_metadata', '0']
+    else:
+        return None, None
+    return ext, ['-vn'] + opts + fe + chn
+
+
+def copyOptions(codec):
+    # ffmpeg arguments of an output copied from an output of the same target (no encoding),
+    # the tags come from the first input
+    opts = ['-c', 'copy', '-map_metadata', '0', '-map_metadata:s:a', '0:s:a']
+    if codec == 'MP3':
+        opts += ['-id3v2_version', '3']
+    return opts
+
+
+def fastPath(codec, qvalue, info, channels):
+    # lossless output written without encoding: 'copy' (same stream) or 'remux' (PCM samples in
+    # the byte order of the container) and the ffmpeg arguments, (None, None) if it must be encoded
+    # (FLAC and ALAC streams are encoded again only for the highest compression)
+    if info is None or (channels != 0 and channels != info['channels']):
+        return None, None
+    source = info['codec']
+    copy = ['-vn', '-c:a', 'copy', '-map_metadata', '0']
+    if codec in ['FLAC', 'ALAC'] and source == codec.lower() and qvalue != QVAL[codec]['High'][0]:
+        return 'copy', copy
+    if codec in PCM_ORDER and PCM.match(source):
+        if source.endswith(PCM_ORDER[codec]):
+            return 'copy', copy
+        return 'remux', ['-vn', '-c:a', source[:-2] + PCM_ORDER[codec], '-map_metadata', '0']
+    return None, None
@@ -0,0 +1,502 @@
+"""     _               _____                _ _
+       | |        /\   / ____|              | (_)
+  _ __ | |       /  \ | |     __ _ _   _  __| |_  ___
+ | '_ \| |      / /\ \| |    / _` | | | |/ _` | |/ _ \
+ | |_) | |____ / ____ \ |___| (_| | |_| | (_| | | (_) |
+ | .__/|______/_/    \_\_____\__,_|\__,_|\__,_|_|\___/
+ | |
+ |_|
+
+This file is part of pLAC-audio.
+
+pLAC-audio is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pLAC-audio is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pLAC-audio.  If not, see <http://www.gnu.org/licenses/>
+
+Copyright (c) 2019 Fabrice Zaoui
+
+License GNU GPL v3
+"""
+import os
+import math
+import time
+import logging
+import tempfile
+import traceback
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from encoder import outputOptions, copyOptions, fastPath
+from launcher import runFFmpeg, duration, probe, CancelToken
+from cueSheet import Track, parseCue
+from dedupe import Dedupe, DEFERRED, audioFingerprint, sameAudio
+from telemetry import Telemetry, Throughput, Activity
+from profiling import profiler
+
+# lossless formats found by their (lowercase) file extension
+FORMATS = {'.m4a': 'ALAC', '.flac': 'FLAC', '.dsf': 'DSF', '.ape': 'APE', '.wav': 'WAV', '.aif': 'AIFF',
+           '.aiff': 'AIFF'}
+
+
+def scanFiles(folder, counts=None):
+    # single walk of the tree, the audio files (path and size) are yielded as soon as they are found
+    # (hidden files and folders are ignored as with glob)
+    # an album image with its CUE sheet yields its tracks instead (share of the image size)
+    if counts is not None:
+        for fmt in FORMATS.values():
+            counts.setdefault(fmt, 0)
+    folders = [folder]
+    while folders:
+        started = time.perf_counter()
+        try:
+            with os.scandir(folders.pop()) as it:
+                entries = [entry for entry in it if not entry.name.startswith('.')]
+        except OSError:
+            continue
+        subfolders = []
+        files = []
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    subfolders.append(entry.path)
+                else:
+                    files.append(entry)
+            except OSError:
+                continue
+        sheets = []
+        names = [entry.name for entry in files]
+        for entry in files:
+            if entry.name.lower().endswith('.cue'):
+                sheet = parseCue(entry.path, names)
+                if sheet is not None and all(sheet.image != other.image for other in sheets):
+                    sheets.append(sheet)
+        images = {sheet.image: sheet for sheet in sheets}
+        profiler.add('scan', time.perf_counter() - started)
+        for entry in files:
+            fmt = FORMATS.get(os.path.splitext(entry.name)[1].lower())
+            if fmt is not None:
+                try:
+                    size = entry.stat().st_size
+                except OSError:
+                    size = 0
+                sheet = images.get(entry.path)
+                if sheet is None:
+                    if counts is not None:
+                        counts[fmt] += 1
+                    yield entry.path, size
+                    continue
+                for track in sheet.tracks:
+                    track.size = size // len(sheet.tracks)
+                    if counts is not None:
+                        counts[fmt] += 1
+                    yield track, track.size
+        folders.extend(reversed(subfolders))
+
+
+def changedFiles(path):
+    # jobs of a new or modified file: the file itself, or the tracks of the album image
+    # described by a CUE sheet of its folder (also when the sheet is the modified file)
+    folder = os.path.dirname(path)
+    try:
+        names = [entry.name for entry in os.scandir(folder) if not entry.name.startswith('.') and entry.is_file()]
+        size = os.path.getsize(path)
+    except OSError:
+        return []
+    for name in names:
+        if name.lower().endswith('.cue'):
+            sheet = parseCue(os.path.join(folder, name), names)
+            if sheet is not None and path in [sheet.image, sheet.cue]:
+                try:
+                    size = os.path.getsize(sheet.image)
+                except OSError:
+                    return []
+                for track in sheet.tracks:
+                    track.size = size // len(sheet.tracks)
+                return [(track, track.size) for track in sheet.tracks]
+    if os.path.splitext(path)[1].lower() in FORMATS:
+        return [(path, size)]
+    return []
+
+
+def probeJob(job, probes):
+    with profiler.timer('probe'):
+        if isinstance(job, Track):
+            return job.sheet.probe(probes)
+        return probes.probe(job)
+
+
+def probeFiles(files, probes, nthreads=4):
+    # probe stage: the files of scanFiles are probed in parallel (cached results first) and yielded
+    # in the same order as (job, size, info), a few files ahead of the conversion
+    with ThreadPoolExecutor(nthreads) as pool:
+        pending = collections.deque()
+        for job, size in files:
+            pending.append((job, size, pool.submit(probeJob, job, probes)))
+            while len(pending) > 4 * nthreads or (len(pending) > 0 and pending[0][2].done()):
+                job, size, future = pending.popleft()
+                yield job, size, future.result()
+        while len(pending) > 0:
+            job, size, future = pending.popleft()
+            yield job, size, future.result()
+
+
+def audioDuration(job, info):
+    # seconds of audio of a job (0 if unknown)
+    if isinstance(job, Track):
+        return job.duration() or 0.0
+    return 0.0 if info is None else info['duration']
+
+
+# lossless output formats: their segments are joined without any gap
+LOSSLESS = ['FLAC', 'ALAC', 'WAV', 'AIFF']
+# output formats of the split files: not FLAC, the stream copy of the segments would keep the STREAMINFO
+# (length, MD5) of the first one and short frames in the middle of a fixed block size stream
+SPLIT_FORMATS = ['ALAC', 'WAV', 'AIFF']
+
+
+# long file cut in segments encoded in parallel, the worker ending the last segment joins them
+class Split:
+    def __init__(self, audio_file_in, size, mtime, outputs, duration, nsegments):
+        self.audio_file_in = audio_file_in
+        self.size = size
+        self.mtime = mtime
+        self.outputs = outputs
+        self.duration = duration
+        self.remaining = nsegments
+        self.files = [[] for output in outputs]  # temporary segment files of each output
+        self.ret = 0
+        self.errors = []
+        self.start = time.monotonic()
+        self.lock = threading.Lock()
+
+
+class Segment:
+    def __init__(self, split, index, start, length):
+        self.split = split
+        self.index = index
+        self.start = start
+        self.length = length  # None for the last segment
+
+
+# conversion of the lossless files to the targets (no dependency on Qt: used by the GUI and the command line)
+class Converter:
+    def __init__(self, targets, lossless_folder, samplerate, channels, split=0, nworkers=1):
+        self.targets = targets
+        self.lossless_folder = lossless_folder
+        self.samplerate = samplerate
+        self.channels = channels
+        self.split = split  # duration (seconds) above which a file is split in segments (0: never)
+        self.nworkers = nworkers
+        self.lock = threading.Lock()
+        self.stats = {'converted': 0, 'skipped': 0, 'failed': 0, 'cancelled': 0}
+        self.failures = []
+        self.cancel = CancelToken()
+        self.telemetry = Telemetry()
+        self.throughput = Throughput()
+        self.activity = Activity()
+        self.governor = None
+        self.dedupe = Dedupe()  # None: every copy of the same audio is encoded
+        self.probes = None  # cache of the ffprobe results (None: probed only when needed)
+        self.sep = '/'
+        if os.name == 'nt':
+            self.sep = '\\'
+
+    def count(self, status, size=0, seconds=0.0):
+        with self.lock:
+            self.stats[status] += 1
+        if status == 'skipped':
+            self.throughput.skip(size, seconds)
+        elif status != 'cancelled':
+            self.throughput.done(size, seconds)
+        return status
+
+    def fail(self, audio_file_in, ret, errors):
+        # the failed files are kept with the end of the ffmpeg error output
+        logging.error('Conversion failed (exit status ' + str(ret) + '): ' + audio_file_in)
+        for line in errors:
+            logging.debug('ffmpeg: ' + line)
+        with self.lock:
+            self.failures.append((audio_file_in, ret, errors))
+
+    def crash(self, audio_file_in):
+        # unexpected error of a job (database, file system...): logged with its traceback and counted as a
+        # failure, the worker goes on with the next files
+        logging.exception('Unexpected error with: ' + audio_file_in)
+        self.fail(audio_file_in, -1, traceback.format_exc().splitlines()[-1:])
+        return self.count('failed')
+
+    def convert2lossy(self, job, worker=0, jobs=None):
+        # 'job': lossless file or track of an album image (CUE sheet)
+        # returns the status of the file: 'converted', 'skipped', 'failed' or 'cancelled'
+        # (None if the file is split in segments added to 'jobs' or put back in 'jobs' as the copy of a
+        # source still in progress)
+        track = job if isinstance(job, Track) else None
+        audio_file_in = job if track is None else track.sheet.image
+        source = str(job)  # name of the source in the manifests and the report
+        path_audio = os.path.dirname(audio_file_in)
+        file_name = os.path.splitext(os.path.basename(audio_file_in))[0]
+        file_name_ext = os.path.splitext(os.path.basename(audio_file_in))[1].lower()
+        len_indir = len(self.lossless_folder)
+        path_audio = path_audio[len_indir:]
+        try:
+            stat = os.stat(audio_file_in)
+            size = stat.st_size
+            mtime = stat.st_mtime
+            if track is not None:
+                # a track is converted again if the image or its sheet are modified
+                size = track.size
+                mtime = max(mtime, os.path.getmtime(track.sheet.cue))
+                file_name = track.fileName()
+        except OSError as e:
+            self.fail(source, -1, [str(e)])
+            return self.count('failed')
+        # DSD found by the probed codec (by the extension only if not probed)
+        info = None
+        if self.probes is not None:
+            info = probeJob(job, self.probes)
+        if info is not None and info['codec'].startswith('dsd_'):
+            file_name_ext = '.dsf'
+        # the source is decoded once for all the targets still to convert
+        outputs = []
+        started = time.perf_counter()
+        for target in self.targets:
+            ext, opts = outputOptions(target.codec, target.qval, file_name_ext, self.samplerate, self.channels)
+            if ext is None:
+                continue
+            path_out = target.lossy_location + path_audio
+            audio_file_out = path_out + self.sep + file_name + '.' + ext
+            # already converted with the same settings? (no access to the destination folder)
+            if target.manifest.isDone(source, size, mtime):
+                continue
+            # converted before the manifest existed (an output of other settings is converted again)
+            if not target.manifest.isKnown(source) and os.path.isfile(audio_file_out) \
+                    and os.path.getmtime(audio_file_out) >= mtime:
+                target.manifest.add(source, size, mtime, audio_file_out)
+                continue
+            if not os.path.isdir(path_out):
+                try:
+                    os.makedirs(path_out)
+                except OSError:
+                    # logging.exception('Unable to create the destination folder')
+                    pass
+            # written to a temporary file renamed only once ffmpeg has succeeded
+            audio_file_tmp = path_out + self.sep + '.' + file_name + '.part.' + ext
+            target.manifest.begin(audio_file_tmp)
+            outputs.append((target, opts, audio_file_tmp, audio_file_out))
+        profiler.add('outputs', time.perf_counter() - started)
+        if len(outputs) == 0:
+            return self.count('skipped', size, audioDuration(job, info))
+        # path of each output: 'encode', or 'copy'/'remux' for a lossless output of a source already
+        # in the same codec (I/O only), 'dedupe' for the outputs copied from the same audio
+        paths = {}
+        if track is None and file_name_ext not in ['.ape', '.dsf'] \
+                and any(target.codec in LOSSLESS for target, opts, audio_file_tmp, audio_file_out in outputs):
+            if info is None:
+                info = probe(audio_file_in)
+            for i, (target, opts, audio_file_tmp, audio_file_out) in enumerate(outputs):
+                path, fast = fastPath(target.codec, target.qval, info, self.channels)
+                if path is not None:
+                    outputs[i] = (target, fast, audio_file_tmp, audio_file_out)
+                    paths[target] = path
+        # long file to ALAC, WAV or AIFF only: segments encoded in parallel
+        # (no need to probe the files too small to last longer than 'split' at 256 kbit/s)
+        if track is None and jobs is not None and self.split > 0 and self.nworkers > 1 and stat.st_size > self.split * 32000 \
+                and len(paths) == 0 and all(target.codec in SPLIT_FORMATS for target, opts, audio_file_tmp, audio_file_out in outputs):
+            if info is None:
+                info = probe(audio_file_in)
+            if info is not None and info['duration'] > self.split:
+                self.splitFile(audio_file_in, size, mtime, outputs, info['duration'], jobs)
+                return None
+        # same audio as a source converted before in the run (compilation, re-tagged copy...):
+        # its outputs are copied with the tags of this file
+        fingerprint = None
+        group = None
+        if track is None and self.dedupe is not None and len(paths) < len(outputs):
+            fingerprint = audioFingerprint(audio_file_in)
+            if fingerprint is not None:
+                group = self.dedupe.claim(fingerprint, job, jobs)
+            if group is DEFERRED:
+                # the worker goes on with other files meanwhile
+                for target, opts, audio_file_tmp, audio_file_out in outputs:
+                    target.manifest.abort(audio_file_tmp)
+                return None
+        status = None
+        length = audioDuration(job, info)
+        self.activity.begin(worker, source, size, length)
+        progress = lambda values: self.activity.update(worker, values)
+        try:
+            start = time.monotonic()
+            ret, errors, seconds = 0, [], 0.0
+            encoded = outputs
+            if group is not None:
+                group.event.wait()
+                self.activity.begin(worker, source, size, length)  # waiting for the first copy is not a stall
+                copies = [output for output in outputs if output[0] not in paths
+                          and os.path.isfile(group.outputs.get(output[0], ''))]
+                if len(copies) > 0 and not sameAudio(fingerprint, audio_file_in, group.source):
+                    copies = []
+                encoded = [output for output in outputs if output not in copies]
+                if len(copies) > 0:
+                    logging.debug('Same audio as ' + group.source + ': ' + audio_file_in)
+                    args = ['-nostdin', '-nostats', '-loglevel', 'error', '-y', '-i', audio_file_in]
+                    for target, opts, audio_file_tmp, audio_file_out in copies:
+                        args += ['-i', group.outputs[target]]
+                    for n, (target, opts, audio_file_tmp, audio_file_out) in enumerate(copies):
+                        args += ['-map', str(n + 1) + ':a'] + copyOptions(target.codec) + [audio_file_tmp]
+                    ret, errors, info = runFFmpeg(args, self.cancel, progress=progress)
+                    seconds = duration(info)
+                    paths.update({target: 'dedupe' for target, opts, audio_file_tmp, audio_file_out in copies})
+            if len(encoded) > 0 and ret == 0:
+                input_args, output_args = [], []
+                if track is not None:
+                    input_args, output_args = track.trimArgs()
+                    output_args += track.metadata()
+                args = ['-nostdin', '-nostats', '-loglevel', 'error', '-y'] + input_args + ['-i', audio_file_in]
+                for target, opts, audio_file_tmp, audio_file_out in encoded:
+                    args += opts + output_args + [audio_file_tmp]
+                ret, errors, info = runFFmpeg(args, self.cancel, progress=progress)
+                seconds = max(seconds, duration(info))
+            wall_time = time.monotonic() - start
+            with profiler.timer('finish'):
+                status = self.finish(source, size, mtime, outputs, ret, errors, seconds, wall_time, worker, paths)
+            return status
+        finally:
+            self.activity.end(worker)
+            # the copies of the same audio waiting for this file can go on
+            if fingerprint is not None and group is None:
+                self.dedupe.publish(fingerprint, audio_file_in, {target: audio_file_out for target, opts, audio_file_tmp,
+                                    audio_file_out in outputs if status == 'converted'})
+
+    def finish(self, audio_file_in, size, mtime, outputs, ret, errors, seconds, wall_time, worker, paths=None):
+        # the temporary files are renamed, the manifests and the statistics are updated
+        status = 'converted'
+        if ret != 0 and self.cancel.isStopped():
+            # the partial outputs are removed
+            for target, opts, audio_file_tmp, audio_file_out in outputs:
+                target.manifest.abort(audio_file_tmp)
+            return self.count('cancelled')
+        if ret != 0:
+            self.fail(audio_file_in, ret, errors)
+        for target, opts, audio_file_tmp, audio_file_out in outputs:
+            if ret == 0:
+                try:
+                    os.replace(audio_file_tmp, audio_file_out)
+                except OSError as e:
+                    ret = -1
+                    self.fail(audio_file_in, ret, [str(e)])
+            output_size = 0
+            if ret == 0:
+                target.manifest.add(audio_file_in, size, mtime, audio_file_out, audio_file_tmp)
+                try:
+                    output_size = os.path.getsize(audio_file_out)
+                except OSError:
+                    pass
+            else:
+                target.manifest.abort(audio_file_tmp)
+                status = 'failed'
+            self.telemetry.record(file=audio_file_in, output=audio_file_out, codec=target.codec, quality=target.qval,
+                                  path=paths.get(target, 'encode') if paths else 'encode', worker=worker, status='converted' if ret == 0 else 'failed', exit=ret,
+                                  source_size=size, output_size=output_size, duration=seconds,
+                                  wall_time=round(wall_time, 3))
+            logging.debug('Output ' + ('written' if ret == 0 else 'failed') + ': ' + audio_file_out,
+                          extra={'job': {'file': audio_file_in, 'codec': target.codec, 'quality': target.qval,
+                                         'path': paths.get(target, 'encode') if paths else 'encode',
+                                         'duration': round(seconds, 3), 'status': 'converted' if ret == 0 else 'failed',
+                                         'exit': ret, 'wall_time': round(wall_time, 3), 'worker': worker}})
+        return self.count(status, size, seconds)
+
+    def splitFile(self, audio_file_in, size, mtime, outputs, seconds, jobs):
+        # one segment per worker (whole seconds: the cuts fall exactly on a sample)
+        length = int(math.ceil(seconds / self.nworkers))
+        nsegments = int(math.ceil(seconds / length))
+        split = Split(audio_file_in, size, mtime, outputs, seconds, nsegments)
+        for k, (target, opts, audio_file_tmp, audio_file_out) in enumerate(outputs):
+            ext = os.path.splitext(audio_file_out)[1]
+            for i in range(nsegments):
+                segment_tmp = audio_file_tmp[:-len('.part' + ext)] + '.seg%03d.part' % i + ext
+                target.manifest.begin(segment_tmp)
+                split.files[k].append(segment_tmp)
+        logging.info('Long file split in ' + str(nsegments) + ' segments: ' + audio_file_in)
+        for i in range(nsegments):
+            jobs.put(Segment(split, i, i * length, length if i < nsegments - 1 else None), first=True)
+
+    def convertSegment(self, segment, worker=0):
+        # returns the status of the whole file once its last segment is done (None before)
+        split = segment.split
+        # 1 second decoded before the cut and dropped: the decoder state is the same as in a single pass
+        preroll = 1 if segment.start > 0 else 0
+        args = ['-nostdin', '-nostats', '-loglevel', 'error', '-y', '-ss', str(segment.start - preroll),
+                '-i', split.audio_file_in]
+        for k, (target, opts, audio_file_tmp, audio_file_out) in enumerate(split.outputs):
+            if preroll > 0:
+                args += ['-af', 'atrim=start=' + str(preroll)]
+            if segment.length is not None:
+                args += ['-t', str(segment.length)]
+            args += opts + [split.files[k][segment.index]]
+        length = split.duration - segment.start if segment.length is None else segment.length
+        self.activity.begin(worker, split.audio_file_in + ' [segment ' + str(segment.index + 1) + ']',
+                            int(split.size * length / split.duration), length)
+        try:
+            ret, errors, info = runFFmpeg(args, self.cancel,
+                                          progress=lambda values: self.activity.update(worker, values))
+        finally:
+            self.activity.end(worker)
+        with split.lock:
+            if ret != 0 and split.ret == 0:
+                split.ret = ret
+                split.errors = errors
+            split.remaining -= 1
+            if split.remaining > 0:
+                return None
+        return self.joinSegments(split, worker)
+
+    def joinSegments(self, split, worker):
+        ret = split.ret
+        errors = split.errors
+        for k, (target, opts, audio_file_tmp, audio_file_out) in enumerate(split.outputs):
+            if ret == 0:
+                # concat demuxer and stream copy, the tags come from the source
+                with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+                    for segment_tmp in split.files[k]:
+                        f.write("file '" + segment_tmp.replace("'", "'\\''") + "'\n")
+                ret, errors, info = runFFmpeg(['-nostdin', '-nostats', '-loglevel', 'error', '-y', '-f', 'concat',
+                                               '-safe', '0', '-i', f.name, '-i', split.audio_file_in, '-map', '0:a',
+                                               '-map_metadata', '1', '-c', 'copy', audio_file_tmp], self.cancel)
+                os.remove(f.name)
+            for segment_tmp in split.files[k]:
+                target.manifest.abort(segment_tmp)
+        return self.finish(split.audio_file_in, split.size, split.mtime, split.outputs, ret, errors, split.duration,
+                           time.monotonic() - split.start, worker,
+                           {target: 'split' for target, opts, audio_file_tmp, audio_file_out in split.outputs})
+
+
+def convertFiles(jobs, converter, callback=None, worker=0):
+    # loop of a worker: pull the files from the queue until it is closed and empty (or cancelled)
+    with profiler.thread():
+        while not converter.cancel.isCancelled():
+            if converter.governor is not None:
+                converter.governor.wait(worker, jobs, converter.cancel)
+            with profiler.timer('queue wait'):
+                job = jobs.get()
+            if job is None or converter.cancel.isCancelled():
+                break
+            audio_file_in = job.split.audio_file_in if isinstance(job, Segment) else str(job)
+            try:
+                if isinstance(job, Segment):
+                    status = converter.convertSegment(job, worker)
+                else:
+                    status = converter.convert2lossy(job, worker, jobs)
+            except Exception:
+                status = converter.crash(audio_file_in)
+            if status is not None and callback is not None:
+                with profiler.timer('progress'):
+                    callback(audio_file_in, status)
@@ -0,0 +1,107 @@
+"""     _               _____                _ _
+       | |        /\   / ____|              | (_)
+  _ __ | |       /  \ | |     __ _ _   _  __| |_  ___
+ | '_ \| |      / /\ \| |    / _` | | | |/ _` | |/ _ \
+ | |_) | |____ / ____ \ |___| (_| | |_| | (_| | | (_) |
+ | .__/|______/_/    \_\_____\__,_|\__,_|\__,_|_|\___/
+ | |
+ |_|
+
+This file is part of pLAC-audio.
+
+pLAC-audio is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pLAC-audio is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pLAC-audio.  If not, see <http://www.gnu.org/licenses/>
+
+Copyright (c) 2019 Fabrice Zaoui
+
+License GNU GPL v3
+"""
+import time
+import logging
+import threading
+import psutil
+
+
+# 'Auto' number of CPUs: the number of active workers is tuned during the run
+# from the CPU activity, the I/O wait and the measured throughput (hill climbing)
+# the throughput counts the progress of the files being converted ('activity'): a period
+# with no file completed is not a period without work
+class Governor(threading.Thread):
+    def __init__(self, nmax, throughput, period=10.0, activity=None):
+        threading.Thread.__init__(self, daemon=True)
+        self.nmax = nmax
+        self.throughput = throughput
+        self.activity = activity
+        self.period = period
+        self.limit = max(1, nmax // 2)
+        self.cond = threading.Condition()
+        self.stopped = threading.Event()
+        self.last_rate = None
+        self.last_change = 0
+        self.hold = 0
+
+    def wait(self, worker, jobs, cancel):
+        # the workers with a number above the limit wait for their turn (or the end of the queue)
+        with self.cond:
+            while worker >= self.limit and not jobs.isDone() and not cancel.isCancelled() \
+                    and not self.stopped.is_set():
+                self.cond.wait(1.0)
+
+    def setLimit(self, limit, reason):
+        with self.cond:
+            logging.info('Auto CPUs: ' + str(self.limit) + ' -> ' + str(limit) + ' (' + reason + ')')
+            self.last_change = limit - self.limit
+            self.limit = limit
+            self.cond.notify_all()
+
+    def stop(self):
+        self.stopped.set()
+        with self.cond:
+            self.cond.notify_all()
+
+    def progress(self):
+        # bytes converted so far, with the share of the files in progress
+        if self.activity is None:
+            return self.throughput.done_bytes
+        return self.throughput.done_bytes + self.activity.bytes()
+
+    def run(self):
+        psutil.cpu_times_percent()
+        last_bytes = self.progress()
+        last_time = time.monotonic()
+        while not self.stopped.wait(self.period):
+            times = psutil.cpu_times_percent()
+            iowait = getattr(times, 'iowait', 0.0)
+            cpu = max(0.0, 100.0 - times.idle - iowait)
+            now = time.monotonic()
+            progress = self.progress()
+            rate = (progress - last_bytes) / (now - last_time)
+            last_bytes = progress
+            last_time = now
+            logging.debug('Auto CPUs: %d workers, cpu %.0f%%, iowait %.0f%%, %.1f MB/s'
+                          % (self.limit, cpu, iowait, rate / 1e6))
+            if rate <= 0:
+                # nothing measured (no duration known for the files in progress): no comparison
+                continue
+            if self.last_rate is not None and self.last_change > 0 and rate < 0.97 * self.last_rate:
+                # one more worker did not help: back and no new try for a few periods
+                self.setLimit(self.limit - 1, 'throughput %.1f -> %.1f MB/s' % (self.last_rate / 1e6, rate / 1e6))
+                self.hold = 6
+            elif iowait > 30.0 and self.limit > 1:
+                self.setLimit(self.limit - 1, 'I/O wait %.0f%%' % iowait)
+            elif cpu < 85.0 and iowait < 15.0 and self.limit < self.nmax and self.hold == 0:
+                self.setLimit(self.limit + 1, 'CPU %.0f%%' % cpu)
+            else:
+                self.last_change = 0
+                self.hold = max(0, self.hold - 1)
+            self.last_rate = rate
@@ -0,0 +1,76 @@
+"""     _               _____                _ _
+       | |        /\   / ____|              | (_)
+  _ __ | |       /  \ | |     __ _ _   _  __| |_  ___
+ | '_ \| |      / /\ \| |    / _` | | | |/ _` | |/ _ \
+ | |_) | |____ / ____ \ |___| (_| | |_| | (_| | | (_) |
+ | .__/|______/_/    \_\_____\__,_|\__,_|\__,_|_|\___/
+ | |
+ |_|
+
+This file is part of pLAC-audio.
+
+pLAC-audio is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pLAC-audio is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pLAC-audio.  If not, see <http://www.gnu.org/licenses/>
+
+Copyright (c) 2019 Fabrice Zaoui
+
+License GNU GPL v3
+"""
+import heapq
+import itertools
+import threading
+
+
+# shared queue of audio files: each thread pulls the next file as soon as it is free
+# so that all the cores stay busy until the end (longest files first if requested)
+class JobQueue:
+    def __init__(self, largest_first=False):
+        self.largest_first = largest_first
+        self.heap = []
+        self.count = itertools.count()
+        self.cond = threading.Condition()
+        self.closed = False
+
+    def __len__(self):
+        with self.cond:
+            return len(self.heap)
+
+    def put(self, audio_file, weight=0, first=False):
+        # 'weight': audio duration of the file (order of 'largest_first')
+        # 'first' for the jobs to run before any other (segments of a long file)
+        key = -weight if self.largest_first else 0
+        if first:
+            key = float('-inf')
+        with self.cond:
+            heapq.heappush(self.heap, (key, next(self.count), audio_file))
+            self.cond.notify()
+
+    def isDone(self):
+        # closed and empty
+        with self.cond:
+            return self.closed and not self.heap
+
+    def close(self):
+        # no more files will be added
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def get(self):
+        # next file to convert or None when the queue is closed and empty
+        with self.cond:
+            while not self.heap and not self.closed:
+                self.cond.wait()
+            if self.heap:
+                return heapq.heappop(self.heap)[2]
+            return None
@@ -0,0 +1,170 @@
+"""     _               _____                _ _
+       | |        /\   / ____|              | (_)
+  _ __ | |       /  \ | |     __ _ _   _  __| |_  ___
+ | '_ \| |      / /\ \| |    / _` | | | |/ _` | |/ _ \
+ | |_) | |____ / ____ \ |___| (_| | |_| | (_| | | (_) |
+ | .__/|______/_/    \_\_____\__,_|\__,_|\__,_|_|\___/
+ | |
+ |_|
+
+This file is part of pLAC-audio.
+
+pLAC-audio is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pLAC-audio is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pLAC-audio.  If not, see <http://www.gnu.org/licenses/>
+
+Copyright (c) 2019 Fabrice Zaoui
+
+License GNU GPL v3
+"""
+import os
+import re
+import json
+import time
+import logging
+import threading
+import subprocess
+import collections
+from profiling import profiler
+
+# executables (may be changed with the environment variables PLACAUDIO_FFMPEG and PLACAUDIO_FFPROBE)
+FFMPEG = os.environ.get('PLACAUDIO_FFMPEG', 'ffmpeg')
+FFPROBE = os.environ.get('PLACAUDIO_FFPROBE', 'ffprobe')
+# if sys.platform == 'darwin':
+#    FFMPEG = '/Applications/pLACaudio.app/Contents/MacOS/ffmpeg'
+#    FFPROBE = '/Applications/pLACaudio.app/Contents/MacOS/ffprobe'
+# key=value lines written by 'ffmpeg -progress'
+PROGRESS = re.compile(r'^(frame|fps|stream_\d+_\d+_q|bitrate|total_size|out_time_us|out_time_ms|out_time|'
+                      r'dup_frames|drop_frames|speed|progress)=(.*)$')
+
+
+# cooperative cancellation: the workers check it between two files
+# 'drain' lets the files in progress finish, 'now' also stops the running ffmpeg processes
+class CancelToken:
+    def __init__(self, timeout=5.0):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.procs = set()
+        self.mode = None
+
+    def isCancelled(self):
+        return self.mode is not None
+
+    def isStopped(self):
+        return self.mode == 'now'
+
+    def cancel(self, drain=False):
+        with self.lock:
+            if self.mode == 'now':
+                return
+            self.mode = 'drain' if drain else 'now'
+            if drain:
+                return
+            procs = list(self.procs)
+        for proc in procs:
+            self.terminate(proc)
+        # the processes still alive after the timeout are killed
+        killer = threading.Timer(self.timeout, self.kill)
+        killer.daemon = True
+        killer.start()
+
+    def kill(self):
+        with self.lock:
+            procs = list(self.procs)
+        for proc in procs:
+            try:
+                proc.kill()
+            except OSError:
+                pass
+
+    @staticmethod
+    def terminate(proc):
+        try:
+            proc.terminate()
+        except OSError:
+            pass
+
+    def register(self, proc):
+        with self.lock:
+            self.procs.add(proc)
+            stopped = self.mode == 'now'
+        if stopped:
+            self.terminate(proc)
+
+    def unregister(self, proc):
+        with self.lock:
+            self.procs.discard(proc)
+
+
+def runFFmpeg(args, cancel=None, tail=20, progress=None):
+    # ffmpeg is launched without any shell (no quoting issue with the file names)
+    # returns the exit status, the last lines of the error output and the last progress values
+    # (the progress and the errors share the same pipe)
+    # 'progress' is called with the values at the end of each progress block (every half second)
+    # own process group: a Ctrl-C in the terminal goes to pLACaudio only, which decides what to stop
+    if os.name == 'nt':
+        group = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        group = {'start_new_session': True}
+    try:
+        with profiler.timer('spawn'):
+            proc = subprocess.Popen([FFMPEG, '-progress', 'pipe:1'] + args, stdin=subprocess.DEVNULL,
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **group)
+    except OSError as e:
+        logging.error('Unable to run ' + FFMPEG + ': ' + str(e))
+        return -1, [str(e)], {}
+    if cancel is not None:
+        cancel.register(proc)
+    lines = collections.deque(maxlen=tail)
+    info = {}
+    start = time.perf_counter()
+    try:
+        for line in proc.stdout:
+            line = line.decode('utf-8', 'replace').rstrip()
+            match = PROGRESS.match(line)
+            if match is not None:
+                info[match.group(1)] = match.group(2)
+                if progress is not None and match.group(1) == 'progress':
+                    progress(info)
+            else:
+                lines.append(line)
+        proc.stdout.close()
+        ret = proc.wait()
+    finally:
+        if cancel is not None:
+            cancel.unregister(proc)
+        profiler.add('ffmpeg', time.perf_counter() - start)
+    return ret, list(lines), info
+
+
+def duration(info):
+    # audio duration (seconds) written by ffmpeg
+    try:
+        return int(info['out_time_us']) / 1e6
+    except (KeyError, ValueError):
+        return 0.0
+
+
+def probe(path):
+    # codec, duration, sample rate, channels and bit depth of the first audio stream (None if unknown)
+    try:
+        proc = subprocess.run([FFPROBE, '-v', 'error', '-select_streams', 'a:0', '-show_entries',
+                               'format=duration:stream=codec_name,sample_rate,channels,bits_per_raw_sample,'
+                               'bits_per_sample', '-of', 'json', path],
+                              stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=60)
+        data = json.loads(proc.stdout.decode('utf-8', 'replace'))
+        stream = data['streams'][0]
+        bits = int(stream.get('bits_per_raw_sample') or stream.get('bits_per_sample') or 0)
+        return {'codec': stream['codec_name'], 'duration': float(data['format']['duration']),
+                'sample_rate': int(stream['sample_rate']), 'channels': int(stream['channels']), 'bits': bits}
+    except (OSError, subprocess.SubprocessError, ValueError, KeyError, IndexError):
+        return None
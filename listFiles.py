@@ -28,44 +28,76 @@ License GNU GPL v3
 
 """
 
-import glob
-import logging
-from PyQt5.QtWidgets import QMessageBox
+import os
+import time
+from engine import scanFiles, probeFiles, audioDuration
+from profiling import profiler
+from PyQt5.QtCore import QThread, pyqtSignal
 
 
-def listofFiles(self):
-    self.audio_files = []
-    ext = 'm4a'
-    audio_alac = glob.glob(self.lossless_folder + '/**/*.' + ext, recursive=True)
-    ext = 'flac'
-    audio_flac = glob.glob(self.lossless_folder + '/**/*.' + ext, recursive=True)
-    ext = 'dsf'
-    audio_dsf = glob.glob(self.lossless_folder + '/**/*.' + ext, recursive=True)
-    ext = 'ape'
-    audio_ape = glob.glob(self.lossless_folder + '/**/*.' + ext, recursive=True)
-    ext = 'wav'
-    audio_wav = glob.glob(self.lossless_folder + '/**/*.' + ext, recursive=True)
-    ext = 'aif'
-    audio_aiff1 = glob.glob(self.lossless_folder + '/**/*.' + ext, recursive=True)
-    ext = 'aiff'
-    audio_aiff2 = glob.glob(self.lossless_folder + '/**/*.' + ext, recursive=True)
-    audio_aiff = audio_aiff1 + audio_aiff2
-    self.audio_files = audio_alac + audio_flac + audio_dsf + audio_ape + audio_wav + audio_aiff
-    if len(self.audio_files) == 0:
-        logging.error('No files found!')
-        QMessageBox.warning(self, 'Warning', 'No lossless files found!')
-        return
-    else:
-        logging.info('Number of ALAC files: ' + str(len(audio_alac)))
-        logging.info('Number of FLAC files: ' + str(len(audio_flac)))
-        logging.info('Number of DSF files: ' + str(len(audio_dsf)))
-        logging.info('Number of APE files: ' + str(len(audio_ape)))
-        logging.info('Number of WAV files: ' + str(len(audio_wav)))
-        logging.info('Number of AIFF files: ' + str(len(audio_aiff)))
-        logging.info('Total number of files: ' + str(len(self.audio_files)))
+class ScanThread(QThread):
+    files_found = pyqtSignal(int, float)
+    scan_done = pyqtSignal(dict)
+
+    def __init__(self, lossless_folder, jobs=None, throughput=None, probes=None):
+        QThread.__init__(self)
+        self.lossless_folder = lossless_folder
+        self.jobs = jobs
+        self.throughput = throughput
+        self.probes = probes
+
+    def run(self):
+        # the files are probed in parallel, sent to the queue (conversion can start at once)
+        # and counted by batches with their audio duration
+        with profiler.thread():
+            counts = {}
+            n = 0
+            seconds = 0.0
+            last = time.monotonic()
+            files = scanFiles(self.lossless_folder, counts)
+            if self.probes is not None:
+                files = probeFiles(files, self.probes, os.cpu_count() or 4)
+            else:
+                files = ((audio_file, size, None) for audio_file, size in files)
+            for audio_file, size, info in files:
+                if self.isInterruptionRequested():
+                    break
+                duration = audioDuration(audio_file, info)
+                if self.jobs is not None:
+                    self.jobs.put(audio_file, duration)
+                if self.throughput is not None:
+                    self.throughput.add(size, duration)
+                n += 1
+                seconds += duration
+                now = time.monotonic()
+                if now - last > 0.2:
+                    self.files_found.emit(n, seconds)
+                    n = 0
+                    seconds = 0.0
+                    last = now
+            if n > 0:
+                self.files_found.emit(n, seconds)
+            if self.probes is not None:
+                self.probes.commit()
+            if self.jobs is not None:
+                self.jobs.close()
+        self.scan_done.emit(counts)
+
+
+def listofFiles(self, jobs=None, throughput=None):
+    # scan in the background, the counters grow while the files are discovered
+    if self.scan is not None:
+        self.scan.files_found.disconnect()
+        self.scan.scan_done.disconnect()
+        self.scan.requestInterruption()
+        self.scan.wait()
+    self.nfiles = 0
+    self.audio_seconds = 0.0
     self.progress.setMinimum(0)
-    self.progress.setMaximum(len(self.audio_files) - 1)
+    self.progress.setMaximum(0)
     self.progress.setValue(0)
-    self.lcd_count.display(len(self.audio_files))
-    self.nm1 = len(self.audio_files)
-    self.n0 = len(self.audio_files)
+    self.lcd_count.display(0)
+    self.scan = ScanThread(self.lossless_folder, jobs, throughput, self.probes)
+    self.scan.files_found.connect(self.update_file_count)
+    self.scan.scan_done.connect(self.scan_done)
+    self.scan.start()
@@ -0,0 +1,87 @@
+"""     _               _____                _ _
+       | |        /\   / ____|              | (_)
+  _ __ | |       /  \ | |     __ _ _   _  __| |_  ___
+ | '_ \| |      / /\ \| |    / _` | | | |/ _` | |/ _ \
+ | |_) | |____ / ____ \ |___| (_| | |_| | (_| | | (_) |
+ | .__/|______/_/    \_\_____\__,_|\__,_|\__,_|_|\___/
+ | |
+ |_|
+
+This file is part of pLAC-audio.
+
+pLAC-audio is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pLAC-audio is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pLAC-audio.  If not, see <http://www.gnu.org/licenses/>
+
+Copyright (c) 2019 Fabrice Zaoui
+
+License GNU GPL v3
+
+Asynchronous logging: the loggers of every thread only put the records in a queue, a listener thread
+passes them to the handlers (rotating log file, log view of the GUI, standard error...).
+"""
+import os
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+from probeCache import cacheFolder
+
+FORMAT = '%(asctime)s - %(levelname)s -> %(message)s'
+
+
+# the fields of a job given with extra={'job': {...}} are appended as key=value (JSON values)
+class JobFormatter(logging.Formatter):
+    def format(self, record):
+        text = super().format(record)
+        job = getattr(record, 'job', None)
+        if job:
+            text += ' | ' + ' '.join(key + '=' + json.dumps(value) for key, value in job.items())
+        return text
+
+
+def logFile(name):
+    # default log file in the per-user cache folder
+    return os.path.join(cacheFolder(), name)
+
+
+def startLogging(handlers, log_file=None, level=logging.DEBUG, max_bytes=10000000, backups=5):
+    # the handlers already set on the root logger (basicConfig) are moved behind the queue
+    # returns the listener (stopped at exit: the last records are written)
+    root = logging.getLogger()
+    handlers = list(root.handlers) + list(handlers)
+    errors = []
+    if log_file is not None:
+        try:
+            folder = os.path.dirname(log_file)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            rotating = logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backups,
+                                                            encoding='utf-8')
+            rotating.setFormatter(JobFormatter(FORMAT))
+            handlers.append(rotating)
+        except OSError as e:
+            errors.append('Unable to write the log file ' + log_file + ': ' + str(e))
+    records = queue.SimpleQueue()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(level)
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    for error in errors:
+        logging.error(error)
+    if log_file is not None and len(errors) == 0:
+        logging.debug('Log file: ' + log_file)
+    return listener
@@ -0,0 +1,147 @@
+"""     _               _____                _ _
+       | |        /\   / ____|              | (_)
+  _ __ | |       /  \ | |     __ _ _   _  __| |_  ___
+ | '_ \| |      / /\ \| |    / _` | | | |/ _` | |/ _ \
+ | |_) | |____ / ____ \ |___| (_| | |_| | (_| | | (_) |
+ | .__/|______/_/    \_\_____\__,_|\__,_|\__,_|_|\___/
+ | |
+ |_|
+
+This file is part of pLAC-audio.
+
+pLAC-audio is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pLAC-audio is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pLAC-audio.  If not, see <http://www.gnu.org/licenses/>
+
+Copyright (c) 2019 Fabrice Zaoui
+
+License GNU GPL v3
+"""
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+
+
+def settingsKey(codec, qvalue, samplerate, channels):
+    # hash of the encoding settings: a change of codec, quality or channels means a new conversion
+    settings = json.dumps([codec, qvalue, samplerate, channels])
+    return hashlib.sha1(settings.encode('utf-8')).hexdigest()[:16]
+
+
+# connection to the database of a destination folder, shared by all the targets written to this folder
+# (a second connection would wait for the write transaction left open by the batched commits)
+class Database:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.users = 0
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS manifest (source TEXT, settings TEXT, size INTEGER, '
+                        'mtime REAL, output TEXT, PRIMARY KEY (source, settings))')
+        self.db.execute('CREATE TABLE IF NOT EXISTS pending (temp TEXT PRIMARY KEY)')
+        self.db.commit()
+
+
+DATABASES = {}
+DATABASES_LOCK = threading.Lock()
+
+
+def openDatabase(lossy_location):
+    path = os.path.realpath(os.path.join(lossy_location, '.pLACaudio.db'))
+    with DATABASES_LOCK:
+        database = DATABASES.get(path)
+        if database is None:
+            database = Database(path)
+            DATABASES[path] = database
+        database.users += 1
+    return database
+
+
+def closeDatabase(database):
+    with DATABASES_LOCK:
+        database.users -= 1
+        if database.users > 0:
+            return
+        del DATABASES[database.path]
+    with database.lock:
+        database.db.commit()
+        database.db.close()
+
+
+# on-disk index of the converted files (stored in the destination folder)
+# a source is converted again only if its size, its modification time or the settings have changed
+# the temporary files being written are also recorded to be removed after an interrupted run
+class Manifest:
+    def __init__(self, lossy_location, settings):
+        self.settings = settings
+        self.database = openDatabase(lossy_location)
+        self.lock = self.database.lock
+        self.db = self.database.db
+
+    def cleanup(self):
+        # remove the temporary files left by an interrupted run
+        with self.lock:
+            temps = [row[0] for row in self.db.execute('SELECT temp FROM pending')]
+            for temp in temps:
+                try:
+                    os.remove(temp)
+                except OSError:
+                    pass
+            self.db.execute('DELETE FROM pending')
+            self.db.commit()
+        return len(temps)
+
+    def begin(self, temp):
+        # committed at once to survive a crash
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO pending VALUES (?)', (temp,))
+            self.db.commit()
+
+    def abort(self, temp):
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+        with self.lock:
+            self.db.execute('DELETE FROM pending WHERE temp=?', (temp,))
+
+    def isDone(self, source, size, mtime):
+        with self.lock:
+            row = self.db.execute('SELECT size, mtime FROM manifest WHERE source=? AND settings=?',
+                                  (source, self.settings)).fetchone()
+        return row is not None and row[0] == size and row[1] == mtime
+
+    def isKnown(self, source):
+        # recorded under any settings (a source never converted since the manifest exists if not)
+        with self.lock:
+            row = self.db.execute('SELECT 1 FROM manifest WHERE source=? LIMIT 1', (source,)).fetchone()
+        return row is not None
+
+    def add(self, source, size, mtime, output, temp=None):
+        with self.lock:
+            if temp is not None:
+                self.db.execute('DELETE FROM pending WHERE temp=?', (temp,))
+            self.db.execute('INSERT OR REPLACE INTO manifest VALUES (?, ?, ?, ?, ?)',
+                            (source, self.settings, size, mtime, output))
+            self.database.pending += 1
+            if self.database.pending >= 100:  # commit by batches (slow on network shares)
+                self.db.commit()
+                self.database.pending = 0
+
+    def close(self):
+        # the connection is closed with the last manifest of the folder
+        if self.database is not None:
+            closeDatabase(self.database)
+            self.database = None
@@ -52,11 +52,20 @@ import psutil
 import logging
 import subprocess
 from mp3Thread import MP3Thread
+from engine import Converter
+from governor import Governor
+from jobQueue import JobQueue
+from manifest import Manifest
+from probeCache import ProbeCache
+from encoder import Target, QVAL
+from telemetry import formatTime
 from pLogger import PLogger
+from logQueue import startLogging, logFile
 from ddButton import DDButtonFrom, DDButtonTo
 from pPref import Preference
-from pSettings import ChangeStyle, ShowLogger
+from pSettings import ChangeStyle, ShowLogger, SPLIT
 from listFiles import listofFiles
+from profiling import profiler
 from PyQt5.QtWidgets import QApplication, QWidget, QAction, QMenuBar,\
                             QPushButton, QGridLayout, QGroupBox, QFileDialog,\
                             QProgressBar, QVBoxLayout, QHBoxLayout,\
@@ -76,8 +85,13 @@ class App(QWidget):
         self.setBaseSize(480, 640)
         self.lossless_folder = ''
         self.lossy_location = ''
-        self.audio_files = []
+        self.nfiles = 0
+        self.audio_seconds = 0.0
+        self.probes = ProbeCache()
+        self.scan = None
         self.ncpu = 0
+        self.auto = False
+        self.governor = None
         self.btn_lossless = DDButtonFrom(self)
         self.btn_lossless.setText('FLAC / ALAC / DSF / APE / WAV / AIFF')
         self.btn_lossy = DDButtonTo(self)
@@ -94,23 +108,19 @@ class App(QWidget):
         self.grp_log = QGroupBox('logger')
         self.tray_icon = QSystemTrayIcon(self)
         self.threads = []
+        self.jobs = None
+        self.targets = []
+        self.extra_targets = []
+        self.converter = None
+        self.btn_add_target = QPushButton('+')
+        self.btn_del_target = QPushButton('-')
         self.nstart = 0
-        self.nm1 = 0
-        self.n0 = 0
-        self.perfmean = []
         self.compression = 0
         self.timer_cpu = QTimer()
         self.timer_elapsed = QTimer()
         self.timer_perf = QTimer()
         self.start_time = QDateTime.currentDateTime().toPyDateTime()
-        self.qval = {'MP3':{'Low':['9', 'VBR 45-85 kbit/s'], 'Medium':['5', 'VBR 120-150 kbit/s'], 'High':['0', 'VBR 220-260 kbit/s']},
-                     'AAC':{'Low':['64k', 'CBR 64 kbit/s'], 'Medium':['128k', 'CBR 128 kbit/s'], 'High':['256k', 'CBR 256 kbit/s']},
-                     'Ogg Vorbis':{'Low':['0', 'VBR 64 kbit/s'], 'Medium':['5', 'VBR 160 kbit/s'], 'High':['10', 'VBR 500 kbit/s']},
-                     'Opus':{'Low':['32k', 'CBR 32 kbit/s'], 'Medium':['64k', 'CBR 64 kbit/s'], 'High':['128k', 'CBR 128 kbit/s']},
-                     'FLAC':{'Low':['0', 'Compression Level: 0'], 'Medium':['5', 'Compression Level: 5'], 'High':['12', 'Compression Level: 12']},
-                     'ALAC':{'Low':['0', 'Compression Level: 0'], 'Medium':['1', 'Compression Level: 1'], 'High':['2', 'Compression Level:2']},
-                     'WAV': {'Low': ['0', 'No Compression'], 'Medium': ['0', 'No Compression'], 'High': ['0', 'No Compression']},
-                     'AIFF': {'Low': ['0', 'No Compression'],'Medium': ['0', 'No Compression'], 'High': ['0', 'No Compression']}}
+        self.qval = QVAL
         self.danger = "QProgressBar::chunk { background-color: #FF3633;}"
         self.inter = "QProgressBar::chunk { background-color: #FFAF33;}"
         self.safe = "QProgressBar::chunk {background-color: #1CDA19;}"
@@ -122,6 +132,10 @@ class App(QWidget):
         self.trayicon = self.settings.value('trayicon', type=int)
         self.samplerate = self.settings.value('samplerate', type=int)
         self.channels = self.settings.value('channels', type=int)
+        self.largestfirst = self.settings.value('largestfirst', type=int)
+        self.report = self.settings.value('report', type=int)
+        self.split = self.settings.value('split', type=int)
+        self.profile = self.settings.value('profile', type=int)
         self.initUI()
 
     def initUI(self):
@@ -190,6 +204,7 @@ class App(QWidget):
         self.btn_stop.setEnabled(False)
         self.btn_stop.setToolTip('Stop conversion')
         self.btn_stop.setIcon(QIcon('./icon/stop_off.png'))
+        self.btn_stop.clicked.connect(self.call_stop)
 
         # Choosing number of cpu with a ComboBox
         combo = QComboBox()
@@ -197,13 +212,15 @@ class App(QWidget):
         combo.addItem('CPU')
         ncpu = os.cpu_count()
         combo.addItems([str(i+1) for i in range(ncpu)])
+        combo.addItem('Auto')
         combo.currentIndexChanged['int'].connect(self.current_index_changed)
 
-        # logging display
+        # logging display (the debug messages and the job records go to the log file only)
         logTextBox = PLogger(self)
         logTextBox.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s -> %(message)s', "%Y-%m-%d %H:%M"))
-        logging.getLogger().addHandler(logTextBox)
-        logging.getLogger().setLevel(logging.DEBUG)  # default level
+        logTextBox.setLevel(logging.INFO)
+        # the records of every thread go through a queue to the log view and to a rotating log file
+        startLogging([logTextBox], logFile('pLACaudio.log'))
 
         # LCD
         self.lcd_count.setSegmentStyle(2)
@@ -221,7 +238,7 @@ class App(QWidget):
         self.timer_cpu.start(1000)
 
         # Performance
-        self.perf.setText('speed:0 files/sec\t(mean: 0.0)')
+        self.perf.setText('speed: 0.0 MB/s | 0.0x realtime | ETA -')
         self.timer_perf.timeout.connect(self.showPERF)
         self.timer_perf.start(1000)
 
@@ -238,6 +255,12 @@ class App(QWidget):
         self.format.addItems(list(self.qval.keys()))
         self.format.currentTextChanged.connect(self.current_index_changed_format)
 
+        # Extra targets (converted in the same pass)
+        self.btn_add_target.setToolTip('Add the current format, quality and output folder as an extra target')
+        self.btn_add_target.clicked.connect(self.on_click_add_target)
+        self.btn_del_target.setToolTip('Remove the last extra target')
+        self.btn_del_target.clicked.connect(self.on_click_del_target)
+
         # Quality
         self.quality.setToolTip("Choose the compression quality ('Low' for a small file size only!)")
         self.quality.addItem('- Quality')
@@ -254,6 +277,10 @@ class App(QWidget):
         vlayout2 = QVBoxLayout()
         vlayout2.addWidget(self.format)
         vlayout2.addWidget(self.quality)
+        hlayout0 = QHBoxLayout()
+        hlayout0.addWidget(self.btn_add_target)
+        hlayout0.addWidget(self.btn_del_target)
+        vlayout2.addLayout(hlayout0)
         grp_codec = QGroupBox('codec')
         grp_codec.setLayout(vlayout2)
         grp_codec.setToolTip('Audio file type')
@@ -319,6 +346,26 @@ class App(QWidget):
             self.btn_lossy.setToolTip(self.lossy_location)
             logging.info('to folder: ' + self.lossy_location)
 
+    @pyqtSlot()
+    def on_click_add_target(self):
+        if not os.path.isdir(self.lossy_location) or self.format.currentIndex() < 1:
+            QMessageBox.warning(self, 'Warning', 'Choose the format and the output folder of the target')
+            return
+        if self.quality.currentIndex() < 1:
+            if self.format.currentIndex() != 7 and self.format.currentIndex() != 8:  # not WAV and AIFF
+                QMessageBox.warning(self, 'Warning', 'Choose the quality compression')
+                return
+            else:
+                self.myquality = 'Low'  # WAV and AIFF (no compression)
+        target = Target(self.myformat, self.qval[self.myformat][self.myquality][0], self.lossy_location)
+        self.extra_targets.append(target)
+        logging.info('Extra target: ' + str(target))
+
+    @pyqtSlot()
+    def on_click_del_target(self):
+        if len(self.extra_targets) > 0:
+            logging.info('Extra target removed: ' + str(self.extra_targets.pop()))
+
     @pyqtSlot()
     def call_info(self):
         QMessageBox.information(self, "Information", "<a href='https://github.com/fzao/pLACaudio' style='color:#32C896'>pLACaudio v" + version + " </a> - License GNU GPL v3.0 - Copyright (c) 2019\n")
@@ -330,8 +377,13 @@ class App(QWidget):
 
     @pyqtSlot(int)
     def current_index_changed(self, index):
-        self.ncpu = index
-        logging.info('Number of CPUs: ' + str(self.ncpu))
+        self.auto = index > os.cpu_count()
+        if self.auto:
+            self.ncpu = os.cpu_count()
+            logging.info('Number of CPUs: Auto (up to ' + str(self.ncpu) + ')')
+        else:
+            self.ncpu = index
+            logging.info('Number of CPUs: ' + str(self.ncpu))
 
     @pyqtSlot()
     def current_index_changed_qual(self):
@@ -377,39 +429,44 @@ class App(QWidget):
                 return
             else:
                 self.myquality = 'Low'  # WAV and AIFF (no compression)
-        # start time
-        self.start_time = QDateTime().currentDateTime().toPyDateTime()
-        # is the list full?
-        listofFiles(self)
-        if len(self.audio_files) == 0:
-            return
         # shutdown requested?
         if self.poweroff == 2:
             answer = QMessageBox.warning(self, 'Message', 'Computer will be shut down after conversion! Continue?',
                                          QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
             if answer == QMessageBox.No:
                 return
-        # Thread execution
-        n = min(self.ncpu, len(self.audio_files))
-        audio = [self.audio_files[i * n:(i + 1) * n] for i in range((len(self.audio_files) + n - 1) // n)]
-        audio_end = []
-        if len(audio) > 1:
-            audio_end = audio.pop(-1)
-        audio = [[j[i] for j in audio] for i in range(len(audio[0]))]
-        for i in range(len(audio_end)):
-            audio[i].append(audio_end[i])
+        # start time
+        self.start_time = QDateTime().currentDateTime().toPyDateTime()
+        # Thread execution (the files are pulled from a shared queue fed by the scan)
+        self.jobs = JobQueue(self.largestfirst != 0)
+        n = self.ncpu
         self.threads = []
-        for i in range(len(audio)):
-            q = self.qval[self.myformat][self.myquality][0]
-            self.threads.append(MP3Thread(audio[i], self.lossless_folder, self.lossy_location, q, self.myformat,
-                                          self.samplerate, self.channels))
+        # each source is decoded once for all the targets
+        q = self.qval[self.myformat][self.myquality][0]
+        self.targets = [Target(self.myformat, q, self.lossy_location)] + self.extra_targets
+        for target in self.targets:
+            target.manifest = Manifest(target.lossy_location, target.settings(self.samplerate, self.channels))
+            ntemp = target.manifest.cleanup()
+            if ntemp > 0:
+                logging.info('Temporary files of an interrupted conversion removed: ' + str(ntemp))
+        self.converter = Converter(self.targets, self.lossless_folder, self.samplerate, self.channels,
+                                   60 * SPLIT[self.split], n)
+        self.converter.probes = self.probes
+        if self.profile != 0:
+            profiler.enable(cprofile=self.profile == 2)
+        listofFiles(self, self.jobs, self.converter.throughput)
+        if self.auto:
+            self.governor = Governor(n, self.converter.throughput, activity=self.converter.activity)
+            self.converter.governor = self.governor
+            self.governor.start()
+        for i in range(n):
+            self.threads.append(MP3Thread(self.jobs, self.converter, i))
         self.nstart = 0
-        for i in range(len(audio)):
+        for i in range(n):
             self.threads[i].update_progress_bar.connect(self.update_progress_bar)
             self.threads[i].finished.connect(self.done)
             self.threads[i].start()
             self.nstart += 1
-            self.btn_stop.clicked.connect(self.threads[i].terminate)
         logging.info('Conversion in progress...')
         self.tray_icon.showMessage(
             "pLACaudio",
@@ -422,23 +479,73 @@ class App(QWidget):
         self.btn_start.setEnabled(False)
         self.btn_start.setIcon(QIcon('./icon/play_off.png'))
 
+    @pyqtSlot()
+    def call_stop(self):
+        if self.nstart == 0 or self.converter.cancel.isStopped():
+            return
+        box = QMessageBox(self)
+        box.setWindowTitle('Stop')
+        box.setText('Stop the conversion?')
+        btn_now = box.addButton('Stop now', QMessageBox.DestructiveRole)
+        btn_drain = box.addButton('Finish the current files', QMessageBox.AcceptRole)
+        box.addButton(QMessageBox.Cancel)
+        box.exec_()
+        if box.clickedButton() == btn_now:
+            self.stopConversion(drain=False)
+        elif box.clickedButton() == btn_drain:
+            self.stopConversion(drain=True)
+
+    def stopConversion(self, drain=False):
+        # no more files are taken from the queue, the running ffmpeg processes are terminated unless 'drain'
+        if drain:
+            logging.info('Stopping after the files in progress...')
+        else:
+            logging.info('Stopping...')
+        self.converter.cancel.cancel(drain)
+        if self.scan is not None:
+            self.scan.requestInterruption()
+
     @pyqtSlot()
     def done(self):
         self.nstart -= 1
         if self.nstart == 0:
-            logging.info('Done!')
-            if self.poweroff == 0:
+            if self.governor is not None:
+                self.governor.stop()
+                self.governor = None
+            for target in self.targets:
+                target.manifest.close()
+            self.probes.commit()
+            if self.profile != 0:
+                dump = None
+                if self.profile == 2:
+                    dump = os.path.join(self.targets[0].lossy_location, 'pLACaudio_profile_'
+                                        + self.start_time.strftime('%Y%m%d-%H%M%S') + '.prof')
+                profiler.report(dump)
+            if self.report != 0:
+                report = os.path.join(self.targets[0].lossy_location, 'pLACaudio_report_'
+                                      + self.start_time.strftime('%Y%m%d-%H%M%S') + ['', '.csv', '.json'][self.report])
+                try:
+                    self.converter.telemetry.write(report)
+                    logging.info('Report written to: ' + report)
+                except OSError:
+                    logging.exception('Unable to write the report')
+            if self.converter.stats['failed'] > 0:
+                logging.warning('Number of failed conversions: ' + str(self.converter.stats['failed']))
+            if self.converter.cancel.isCancelled():
+                logging.info('Stopped!')
+            else:
+                logging.info('Done!')
+            if self.poweroff == 0 or self.converter.cancel.isCancelled():
                 self.btn_stop.setEnabled(False)
                 self.btn_stop.setIcon(QIcon('./icon/stop_off.png'))
                 self.btn_start.setEnabled(True)
                 self.btn_start.setIcon(QIcon('./icon/play_on.png'))
-                if not self.isHidden():
+                if not self.isHidden() and self.nfiles > 0:
                     QMessageBox.information(self, "Done!", "Conversion done!")
                 self.progress.setValue(0)
                 self.lcd_count.display(0)
                 self.elapsed_time.display('%03d:%02d:%02d' % (0, 0, 0))
-                self.perf.setText('speed:0 files/sec\t(mean: 0.0)')
-                self.perfmean = []
+                self.perf.setText('speed: 0.0 MB/s | 0.0x realtime | ETA -')
                 self.tray_icon.showMessage(
                     "pLACaudio",
                     "Conversion just ended!",
@@ -458,10 +565,33 @@ class App(QWidget):
             else:
                 pass
 
+    @pyqtSlot(int, float)
+    def update_file_count(self, n, seconds):
+        with profiler.timer('gui'):
+            self.nfiles += n
+            self.audio_seconds += seconds
+            self.progress.setMaximum(1000)  # per mille of the bytes to convert
+            self.lcd_count.display(self.lcd_count.value() + n)
+            if not self.btn_stop.isEnabled():
+                self.perf.setText('audio: %.1f h' % (self.audio_seconds / 3600))
+
+    @pyqtSlot(dict)
+    def scan_done(self, counts):
+        if self.nfiles == 0:
+            self.progress.setMaximum(1)
+            logging.error('No files found!')
+            QMessageBox.warning(self, 'Warning', 'No lossless files found!')
+        else:
+            for fmt in counts:
+                logging.info('Number of ' + fmt + ' files: ' + str(counts[fmt]))
+            logging.info('Total number of files: ' + str(self.nfiles))
+            logging.info('Total audio duration: %.1f h' % (self.audio_seconds / 3600))
+
     @pyqtSlot()
     def update_progress_bar(self):
-        self.progress.setValue(self.progress.value() + 1)
-        self.lcd_count.display(self.lcd_count.value() - 1)
+        with profiler.timer('gui'):
+            self.progress.setValue(int(1000 * self.converter.throughput.fraction(self.converter.activity.bytes())))
+            self.lcd_count.display(self.lcd_count.value() - 1)
 
     @pyqtSlot()
     def showCPU(self):
@@ -480,12 +610,15 @@ class App(QWidget):
     @pyqtSlot()
     def showPERF(self):
         if self.btn_stop.isEnabled() == True:
-            self.nm1 = self.n0
-            self.n0 = self.lcd_count.value()
-            delta = self.nm1 - self.n0
-            self.perfmean.append(delta)
-            meanval = sum(self.perfmean) / len(self.perfmean)
-            self.perf.setText('speed: %d files/sec\t(mean: %.2f)' % (delta, meanval))
+            # MB/s and audio seconds per second (moving average) and estimated time left
+            self.converter.throughput.update()
+            self.perf.setText(self.converter.throughput.text())
+            # files in progress: the bar moves during the long files, position and speed of each worker
+            activity = self.converter.activity
+            self.progress.setValue(int(1000 * self.converter.throughput.fraction(activity.bytes())))
+            self.progress.setToolTip(activity.text() or 'Conversion progress')
+            for worker, audio_file_in, idle in activity.stalled():
+                logging.warning('No progress for %.0f s (worker %s): %s' % (idle, worker, audio_file_in))
 
     @pyqtSlot()
     def showTIME(self):
@@ -515,6 +648,7 @@ class App(QWidget):
                                              "Conversion is still in progress. Are you sure to quit?", QMessageBox.Yes |
                                              QMessageBox.No, QMessageBox.No)
                 if reply == QMessageBox.Yes:
+                    self.stopConversion()
                     event.accept()
                 else:
                     event.ignore()
@@ -529,6 +663,7 @@ class App(QWidget):
                                          "Conversion is still in progress. Are you sure to quit?", QMessageBox.Yes |
                                          QMessageBox.No, QMessageBox.No)
             if reply == QMessageBox.Yes:
+                self.stopConversion()
                 self.app.quit()
         else:
             self.app.quit()
@@ -538,10 +673,11 @@ class App(QWidget):
             self.show()
         elif reason == QSystemTrayIcon.MiddleClick:
             if self.nstart > 0:
-                percent = (self.progress.value() - self.progress.minimum()) / (self.progress.maximum() - self.progress.minimum())
-                percent = percent * 100
+                percent = self.converter.throughput.fraction() * 100
+                eta = self.converter.throughput.eta()
                 self.tray_icon.showMessage("pLACaudio",
-                    "Progress: " + "{0:0.1f}".format(percent) + ' %',
+                    "Progress: " + "{0:0.1f}".format(percent) + ' %'
+                    + ('' if eta is None else ' - ETA: ' + formatTime(eta)),
                     QSystemTrayIcon.Information,
                     2000)
 
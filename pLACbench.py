@@ -0,0 +1,442 @@
+"""     _               _____                _ _
+       | |        /\   / ____|              | (_)
+  _ __ | |       /  \ | |     __ _ _   _  __| |_  ___
+ | '_ \| |      / /\ \| |    / _` | | | |/ _` | |/ _ \
+ | |_) | |____ / ____ \ |___| (_| | |_| | (_| | | (_) |
+ | .__/|______/_/    \_\_____\__,_|\__,_|\__,_|_|\___/
+ | |
+ |_|
+
+This file is part of pLAC-audio.
+
+pLAC-audio is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pLAC-audio is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pLAC-audio.  If not, see <http://www.gnu.org/licenses/>
+
+Copyright (c) 2019 Fabrice Zaoui
+
+License GNU GPL v3
+
+Benchmark of the conversion: a deterministic corpus of WAV, AIFF, FLAC and ALAC files is generated
+with the ffmpeg lavfi sources, then converted to every format and quality at several numbers of
+workers. The timings are written as JSON to compare two commits or two machines:
+ >python3 pLACbench.py --output before.json
+ >python3 pLACbench.py --output after.json
+ >python3 pLACbench.py --compare before.json after.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+import threading
+import tracemalloc
+import launcher
+from engine import Converter, scanFiles, probeFiles, audioDuration, convertFiles
+from encoder import Target, QVAL
+from jobQueue import JobQueue
+from manifest import Manifest
+from probeCache import ProbeCache
+from pLACcli import Progress
+
+# formats of the corpus: ffmpeg codec and extension
+CORPUS = {'WAV': ('pcm_s16le', 'wav'), 'AIFF': ('pcm_s16be', 'aif'), 'FLAC': ('flac', 'flac'), 'ALAC': ('alac', 'm4a')}
+CORPUS_VERSION = 1  # to be changed with the generation of the corpus
+
+
+def ffmpegVersion():
+    try:
+        proc = subprocess.run([launcher.FFMPEG, '-version'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        return proc.stdout.decode('utf-8', 'replace').splitlines()[0]
+    except (OSError, IndexError):
+        return None
+
+
+def gitCommit():
+    try:
+        proc = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        return proc.stdout.decode().strip() or None
+    except OSError:
+        return None
+
+
+def corpusSpec(nshort, nlong, short, long):
+    return {'version': CORPUS_VERSION, 'short': [nshort, short], 'long': [nlong, long], 'sample_rate': 44100,
+            'formats': sorted(CORPUS)}
+
+
+def generateCorpus(folder, spec, dsf=None):
+    # pink noise and a sine, a different seed and frequency for each file (no two files with the same audio)
+    # the files already there are kept: the corpus is generated once
+    seed = 0
+    for fmt in sorted(CORPUS):
+        codec, ext = CORPUS[fmt]
+        for kind in ['short', 'long']:
+            count, seconds = spec[kind]
+            path = os.path.join(folder, fmt, kind)
+            os.makedirs(path, exist_ok=True)
+            for i in range(count):
+                seed += 1
+                name = '%s_%02d' % (kind, i + 1)
+                audio_file = os.path.join(path, name + '.' + ext)
+                if os.path.isfile(audio_file):
+                    continue
+                tmp = os.path.join(path, '.' + name + '.part.' + ext)
+                source = 'anoisesrc=d=%d:c=pink:r=44100:a=0.1:s=%d' % (seconds, seed)
+                sine = 'sine=f=%d:d=%d:r=44100' % (220 + 10 * seed, seconds)
+                ret, errors, info = launcher.runFFmpeg(
+                    ['-nostdin', '-nostats', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i', source, '-f', 'lavfi',
+                     '-i', sine, '-filter_complex', '[0][1]amix=inputs=2,aformat=channel_layouts=stereo',
+                     '-metadata', 'title=' + name, '-metadata', 'artist=pLACbench', '-metadata', 'album=' + fmt,
+                     '-c:a', codec, tmp])
+                if ret != 0:
+                    raise RuntimeError('corpus generation failed: ' + ' '.join(errors))
+                os.replace(tmp, audio_file)
+                logging.info('Corpus: ' + audio_file)
+    if dsf is not None:
+        # no DSD encoder in ffmpeg: DSF files are only taken from an existing folder
+        path = os.path.join(folder, 'DSF')
+        os.makedirs(path, exist_ok=True)
+        for name in sorted(os.listdir(dsf)):
+            if name.lower().endswith('.dsf') and not os.path.isfile(os.path.join(path, name)):
+                shutil.copy(os.path.join(dsf, name), path)
+
+
+def timeRun(corpus, codec, qvalue, nworkers, probes, scratch=None):
+    # one full conversion of the corpus in an empty folder
+    out = tempfile.mkdtemp(prefix='pLACbench_', dir=scratch)
+    try:
+        target = Target(codec, qvalue, out)
+        target.manifest = Manifest(out, target.settings(0, 0))
+        converter = Converter([target], corpus, 0, 0, 0, nworkers)
+        converter.probes = probes
+        jobs = JobQueue(True)
+        start = time.perf_counter()
+        workers = [threading.Thread(target=convertFiles, args=(jobs, converter, None, i)) for i in range(nworkers)]
+        for worker in workers:
+            worker.start()
+        for audio_file, size, info in probeFiles(scanFiles(corpus), probes, nworkers):
+            seconds = audioDuration(audio_file, info)
+            jobs.put(audio_file, seconds)
+            converter.throughput.add(size, seconds)
+        jobs.close()
+        for worker in workers:
+            worker.join()
+        wall = time.perf_counter() - start
+        target.manifest.close()
+        return wall, converter
+    finally:
+        shutil.rmtree(out, ignore_errors=True)
+
+
+def runBenchmark(args):
+    corpus = os.path.abspath(args.corpus)
+    spec = corpusSpec(args.short, args.long, args.short_seconds, args.long_seconds)
+    generateCorpus(corpus, spec, args.dsf)
+    probes = ProbeCache(os.path.join(corpus, '.probe.db'))
+    files = list(scanFiles(corpus))
+    seconds = 0.0
+    for audio_file, size, info in probeFiles(iter(files), probes):
+        seconds += audioDuration(audio_file, info)
+    probes.commit()
+    nbytes = sum(size for audio_file, size in files)
+    logging.info('Corpus: %d files, %.1f MB, %.1f min of audio' % (len(files), nbytes / 1e6, seconds / 60))
+    formats = [codec for codec in QVAL if args.format is None or codec.split()[0].lower() in args.format]
+    results = {'commit': gitCommit(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'ffmpeg': ffmpegVersion(),
+               'machine': {'system': platform.system(), 'release': platform.release(), 'machine': platform.machine(),
+                           'processor': platform.processor(), 'cpus': os.cpu_count(),
+                           'python': platform.python_version()},
+               'corpus': dict(spec, files=len(files), bytes=nbytes, seconds=round(seconds, 3)),
+               'repeat': args.repeat, 'runs': []}
+    for codec in formats:
+        qualities = ['Low', 'Medium', 'High']
+        if codec in ['WAV', 'AIFF']:
+            qualities = ['Low']  # no compression: one quality only
+        for quality in qualities:
+            for nworkers in args.workers:
+                walls = []
+                for k in range(args.repeat):
+                    wall, converter = timeRun(corpus, codec, QVAL[codec][quality][0], nworkers, probes, args.scratch)
+                    walls.append(round(wall, 3))
+                best = min(walls)
+                results['runs'].append({'format': codec, 'quality': quality, 'workers': nworkers, 'wall': walls,
+                                        'best': best, 'median': round(statistics.median(walls), 3),
+                                        'mbps': round(nbytes / best / 1e6, 2), 'realtime': round(seconds / best, 1),
+                                        'converted': converter.stats['converted'], 'failed': converter.stats['failed']})
+                logging.info('%s %s, %d workers: %.2f s (%.1fx realtime)%s' % (
+                    codec, quality, nworkers, best, seconds / best,
+                    '' if converter.stats['failed'] == 0 else ', %d failed' % converter.stats['failed']))
+    probes.close()
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1)
+    logging.info('Results written to ' + args.output)
+    return 0
+
+
+# stand-in executables of the overhead benchmark (POSIX shell, started in about a millisecond)
+STUB_FFMPEG = '''#!/bin/sh
+# ffmpeg stand-in written by pLACbench --overhead
+input=
+prev=
+for arg; do
+    [ "$prev" = "-i" ] && input=$arg
+    prev=$arg
+done
+%s
+for arg; do
+    case $arg in
+        *.part.*) %s ;;
+    esac
+done
+echo out_time_us=1000000
+echo progress=end
+'''
+STUB_FFPROBE = '''#!/bin/sh
+# ffprobe stand-in written by pLACbench --overhead
+echo '{"streams": [{"codec_name": "flac", "sample_rate": "44100", "channels": 2, "bits_per_raw_sample": "16"}],
+       "format": {"duration": "1.0"}}'
+'''
+
+
+def writeStubs(folder, mode):
+    # 'touch': empty outputs, 'copy': the source bytes are copied, 'sleep:S': empty outputs after S seconds
+    wait = ''
+    write = ': > "$arg"'
+    if mode == 'copy':
+        write = 'cat "$input" > "$arg"'
+    elif mode.startswith('sleep:'):
+        wait = 'sleep %g' % float(mode.split(':', 1)[1])
+    elif mode != 'touch':
+        raise ValueError('unknown stub: ' + mode)
+    os.makedirs(folder, exist_ok=True)
+    stubs = []
+    for name, text in [('ffmpeg', STUB_FFMPEG % (wait, write)), ('ffprobe', STUB_FFPROBE)]:
+        path = os.path.join(folder, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        os.chmod(path, 0o755)
+        stubs.append(path)
+    return stubs
+
+
+def fakeTree(folder, count, size, per_folder=100):
+    # sparse FLAC files (never read by the stubs unless copied)
+    for i in range(count):
+        path = os.path.join(folder, 'album_%05d' % (i // per_folder))
+        if i % per_folder == 0:
+            os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'track_%02d.flac' % (i % per_folder)), 'wb') as f:
+            f.truncate(size)
+
+
+def peakMemory():
+    # peak resident memory of the process in MB (None if unknown)
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1e6 if sys.platform == 'darwin' else 1e3), 1)
+
+
+def stage(stages, name, wall, count, **fields):
+    stages.append(dict(stage=name, wall=round(wall, 3), per_job_us=round(1e6 * wall / max(1, count), 1),
+                       rss_mb=peakMemory(), **fields))
+    logging.info('%-14s %8.2f s %9.1f us/job%s' % (name, wall, 1e6 * wall / max(1, count), ''.join(
+        ', %s %s' % (key, value) for key, value in fields.items())))
+
+
+def runOverhead(args):
+    # cost of the orchestration alone (scan, probe, queue, spawn, manifest, progress) with stubs as encoders
+    if os.name == 'nt':
+        logging.error('The overhead benchmark needs a POSIX shell for its stubs')
+        return 1
+    count = args.overhead
+    folder = tempfile.mkdtemp(prefix='pLACoverhead_', dir=args.scratch)
+    stages = []
+    try:
+        launcher.FFMPEG, launcher.FFPROBE = writeStubs(os.path.join(folder, 'stub'), args.stub)
+        tree = os.path.join(folder, 'lossless')
+        start = time.perf_counter()
+        fakeTree(tree, count, args.file_size)
+        stage(stages, 'tree', time.perf_counter() - start, count)
+
+        # scan and queue: memory held by the jobs (Python allocations, traced: both stages are slowed down)
+        tracemalloc.start()
+        start = time.perf_counter()
+        files = list(scanFiles(tree))
+        wall = time.perf_counter() - start
+        stage(stages, 'scan', wall, count, heap_mb=round(tracemalloc.get_traced_memory()[1] / 1e6, 1))
+        tracemalloc.stop()
+        tracemalloc.start()
+        jobs = JobQueue(True)
+        start = time.perf_counter()
+        for audio_file, size in files:
+            jobs.put(audio_file, 1.0)
+        jobs.close()
+        while jobs.get() is not None:
+            pass
+        wall = time.perf_counter() - start
+        stage(stages, 'queue', wall, count, heap_mb=round(tracemalloc.get_traced_memory()[1] / 1e6, 1))
+        tracemalloc.stop()
+
+        # probe: one stub ffprobe per file, then the cache only
+        probes = ProbeCache(os.path.join(folder, 'probe.db'))
+        nthreads = os.cpu_count() or 1
+        for name in ['probe', 'probe (cached)']:
+            start = time.perf_counter()
+            for audio_file, size, info in probeFiles(iter(files), probes, nthreads):
+                pass
+            probes.commit()
+            stage(stages, name, time.perf_counter() - start, count, threads=nthreads)
+
+        # spawn: stub ffmpeg launched one after the other (cost of a process, paid by each job)
+        nspawn = min(count, 1000)
+        spawn = os.path.join(folder, 'spawn')
+        os.makedirs(spawn)
+        start = time.perf_counter()
+        for i in range(nspawn):
+            launcher.runFFmpeg(['-i', files[i][0], os.path.join(spawn, '.x.part.mp3')])
+        spawn_wall = (time.perf_counter() - start) / nspawn
+        stage(stages, 'spawn', spawn_wall * nspawn, nspawn)
+
+        # full run: the real path of pLACcli (scan, cached probe, queue, workers, manifest, progress)
+        for nworkers in args.workers:
+            out = os.path.join(folder, 'out_%d' % nworkers)
+            os.makedirs(out)
+            target = Target('MP3', QVAL['MP3']['Low'][0], out)
+            target.manifest = Manifest(out, target.settings(0, 0))
+            converter = Converter([target], tree, 0, 0, 0, nworkers)
+            converter.probes = probes
+            jobs = JobQueue(True)
+            with open(os.devnull, 'w') as stream:
+                progress = Progress(converter.throughput, stream)
+                start = time.perf_counter()
+                workers = [threading.Thread(target=convertFiles, args=(jobs, converter, progress.fileDone, i))
+                           for i in range(nworkers)]
+                for worker in workers:
+                    worker.start()
+                for audio_file, size, info in probeFiles(scanFiles(tree), probes, nworkers):
+                    seconds = audioDuration(audio_file, info)
+                    jobs.put(audio_file, seconds)
+                    converter.throughput.add(size, seconds)
+                jobs.close()
+                for worker in workers:
+                    worker.join()
+                wall = time.perf_counter() - start
+            target.manifest.close()
+            # time of a job in a worker apart from its stub process (no more workers running at once than CPUs:
+            # the workers above would only wait for a CPU)
+            per_job = wall * min(nworkers, os.cpu_count() or 1) / count
+            stage(stages, 'run', wall, count, workers=nworkers,
+                  overhead_us=round(1e6 * max(0.0, per_job - spawn_wall), 1),
+                  converted=converter.stats['converted'], failed=converter.stats['failed'])
+        probes.close()
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    results = {'commit': gitCommit(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+               'machine': {'system': platform.system(), 'release': platform.release(), 'machine': platform.machine(),
+                           'processor': platform.processor(), 'cpus': os.cpu_count(),
+                           'python': platform.python_version()},
+               'overhead': {'jobs': count, 'stub': args.stub, 'file_size': args.file_size, 'stages': stages}}
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1)
+    logging.info('Results written to ' + args.output)
+    return 0
+
+
+def compareOverhead(old, new):
+    # time per job of the stages found in both files (ratio > 1: faster)
+    if old['overhead']['jobs'] != new['overhead']['jobs'] or old['overhead']['stub'] != new['overhead']['stub']:
+        print('Warning: the number of jobs or the stub is not the same')
+    stages = {(stage['stage'], stage.get('workers')): stage for stage in old['overhead']['stages']}
+    print('%-16s %7s %12s %12s %8s' % ('stage', 'workers', 'before', 'after', 'speedup'))
+    for stage in new['overhead']['stages']:
+        key = (stage['stage'], stage.get('workers'))
+        if key in stages and stage['per_job_us'] > 0:
+            print('%-16s %7s %10.1fus %10.1fus %7.2fx' % (key[0], '' if key[1] is None else key[1],
+                                                          stages[key]['per_job_us'], stage['per_job_us'],
+                                                          stages[key]['per_job_us'] / stage['per_job_us']))
+    return 0
+
+
+def compareResults(before, after):
+    # best times of the runs found in both files (ratio > 1: faster)
+    with open(before) as f:
+        old = json.load(f)
+    with open(after) as f:
+        new = json.load(f)
+    if ('overhead' in old) != ('overhead' in new):
+        logging.error('Cannot compare a conversion benchmark with an overhead benchmark (--overhead)')
+        return 2
+    for results in [old, new]:
+        if 'overhead' in results:
+            print('%s  %s  %s cpus' % (results['commit'], results['date'], results['machine']['cpus']))
+            continue
+        print('%s  %s  %s cpus  %s' % (results['commit'], results['date'], results['machine']['cpus'], results['ffmpeg']))
+    if 'overhead' in old:
+        return compareOverhead(old, new)
+    if old['corpus'] != new['corpus']:
+        print('Warning: the corpus is not the same')
+    runs = {(run['format'], run['quality'], run['workers']): run for run in old['runs']}
+    print('%-12s %-7s %7s %10s %10s %8s' % ('format', 'quality', 'workers', 'before', 'after', 'speedup'))
+    for run in new['runs']:
+        key = (run['format'], run['quality'], run['workers'])
+        if key in runs:
+            print('%-12s %-7s %7d %9.2fs %9.2fs %7.2fx' % (key + (runs[key]['best'], run['best'],
+                                                              runs[key]['best'] / run['best'])))
+    return 0
+
+
+def main(argv=None):
+    ncpu = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(prog='pLACbench', description='pLACaudio conversion benchmark')
+    parser.add_argument('--corpus', default='bench_corpus', help='folder of the generated corpus (default: bench_corpus)')
+    parser.add_argument('--short', type=int, default=8, help='number of short files per format (default: 8)')
+    parser.add_argument('--long', type=int, default=1, help='number of long files per format (default: 1)')
+    parser.add_argument('--short-seconds', type=int, default=15, help='duration of the short files (default: 15)')
+    parser.add_argument('--long-seconds', type=int, default=600, help='duration of the long files (default: 600)')
+    parser.add_argument('--dsf', help='folder of DSF files added to the corpus (ffmpeg cannot write DSD)')
+    parser.add_argument('-f', '--format', action='append', choices=sorted(codec.split()[0].lower() for codec in QVAL),
+                        help='output format to time (repeatable, default: all)')
+    parser.add_argument('-w', '--workers', type=lambda text: [int(n) for n in text.split(',')],
+                        default=sorted({1, max(1, ncpu // 2), ncpu}),
+                        help='numbers of workers, comma separated (default: 1, half and all the CPUs)')
+    parser.add_argument('--scratch', help='folder of the outputs (default: temporary folder of the system)')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='runs of each configuration (default: 3)')
+    parser.add_argument('-o', '--output', default='pLACbench.json', help='JSON results (default: pLACbench.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two JSON results')
+    parser.add_argument('--overhead', type=int, nargs='?', const=100000, metavar='JOBS',
+                        help='time the orchestration alone on fake jobs with stub encoders (default: 100000 jobs)')
+    parser.add_argument('--stub', default='touch', help='stub encoder: touch, copy or sleep:SECONDS (default: touch)')
+    parser.add_argument('--file-size', type=int, default=4096,
+                        help='size in bytes of the fake (sparse) files of --overhead (default: 4096)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s -> %(message)s', datefmt='%Y-%m-%d %H:%M')
+    if args.compare is not None:
+        return compareResults(*args.compare)
+    if args.overhead is not None:
+        return runOverhead(args)
+    return runBenchmark(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,407 @@
+"""     _               _____                _ _
+       | |        /\   / ____|              | (_)
+  _ __ | |       /  \ | |     __ _ _   _  __| |_  ___
+ | '_ \| |      / /\ \| |    / _` | | | |/ _` | |/ _ \
+ | |_) | |____ / ____ \ |___| (_| | |_| | (_| | | (_) |
+ | .__/|______/_/    \_\_____\__,_|\__,_|\__,_|_|\___/
+ | |
+ |_|
+
+This file is part of pLAC-audio.
+
+pLAC-audio is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pLAC-audio is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pLAC-audio.  If not, see <http://www.gnu.org/licenses/>
+
+Copyright (c) 2019 Fabrice Zaoui
+
+License GNU GPL v3
+
+Command line (headless) conversion, no PyQt needed:
+ >python3 pLACcli.py --source ~/Music/lossless --dest ~/Music/mp3 --format mp3 --quality high --jobs 8
+
+Watch mode: the files added to the lossless folder later are converted as soon as they are complete
+ >python3 pLACcli.py --source ~/Music/lossless --dest ~/Music/mp3 --format mp3 --watch
+
+Several hosts: a coordinator scans and hands the files to the workers connected to it
+ >python3 pLACcli.py --source /nfs/lossless --dest /nfs/mp3 --format mp3 --serve 7777
+ >python3 pLACcli.py --connect coordinator-host:7777 --jobs 8
+
+The progress is printed on the standard output as JSON lines, the logs go to the standard error
+(every second a 'progress' event with the position and the speed of the file of each worker)
+Exit code: 0 (success), 1 (conversion failures), 2 (bad arguments), 3 (no lossless files found),
+ 4 (stopped by the user: a first Ctrl-C finishes the files in progress, a second one stops at once),
+ 5 (worker unable to reach the coordinator)
+
+Where does the time go? --profile logs the time spent in each stage, --profile-dump adds cProfile
+ >python3 pLACcli.py --source ~/Music/lossless --dest ~/Music/mp3 --format mp3 --profile --profile-dump run.prof
+"""
+import os
+import sys
+import json
+import time
+import signal
+import logging
+import argparse
+import threading
+from engine import Converter, scanFiles, probeFiles, probeJob, audioDuration, changedFiles, convertFiles
+from cueSheet import Track
+from encoder import Target, QVAL, SAMPLERATES
+from jobQueue import JobQueue
+from manifest import Manifest
+from probeCache import ProbeCache
+from cluster import Coordinator, Worker, parseAddress
+from watcher import Watcher
+from profiling import profiler
+from logQueue import startLogging, logFile
+
+# command line names of the output formats (mp3, aac, ogg, opus, flac, alac, wav, aiff)
+FORMAT_NAMES = {codec.split()[0].lower(): codec for codec in QVAL}
+CHANNELS = {'default': 0, 'mono': 1, 'stereo': 2}
+
+
+class Progress:
+    # machine-readable progress: one JSON object per line
+    def __init__(self, throughput, stream=sys.stdout, activity=None):
+        self.throughput = throughput
+        self.stream = stream
+        self.activity = activity
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def emit(self, event, **fields):
+        record = {'event': event, 'time': round(time.time(), 3)}
+        record.update(fields)
+        with self.lock:
+            self.stream.write(json.dumps(record) + '\n')
+            self.stream.flush()
+
+    def fileDone(self, audio_file_in, status):
+        self.emit('file', file=audio_file_in, status=status, done=self.throughput.done_files,
+                  found=self.throughput.total_files)
+
+    def tick(self, period=1.0):
+        # throughput (MB/s, audio seconds per second), time left and files in progress every second
+        while not self.stopped.wait(period):
+            self.throughput.update()
+            status = self.throughput.status()
+            if self.activity is not None:
+                status['progress'] = round(100 * self.throughput.fraction(self.activity.bytes()), 1)
+                status['workers'] = self.activity.status()
+                for worker, audio_file_in, idle in self.activity.stalled():
+                    logging.warning('No progress for %.0f s (worker %s): %s' % (idle, worker, audio_file_in))
+                    self.emit('stall', worker=worker, file=audio_file_in, idle=round(idle, 1))
+            self.emit('progress', **status)
+
+
+class WatchQueue:
+    # files queued in watch mode: a file found again while it is queued or converted (image and CUE
+    # sheet copied together, file still modified...) is not queued twice but checked again once done
+    def __init__(self, jobs, converter, progress):
+        self.jobs = jobs
+        self.converter = converter
+        self.progress = progress
+        self.lock = threading.Lock()
+        self.active = {}  # name -> [job, found again]
+
+    def add(self, job):
+        with self.lock:
+            if str(job) in self.active:
+                self.active[str(job)][1] = True
+                return False
+            self.active[str(job)] = [job, False]
+            return True
+
+    def changed(self, path):
+        for job, size in changedFiles(path):
+            if self.add(job):
+                seconds = audioDuration(job, probeJob(job, self.converter.probes))
+                self.jobs.put(job, seconds)
+                self.converter.throughput.add(size, seconds)
+                self.progress.emit('queued', file=str(job))
+
+    def fileDone(self, audio_file_in, status):
+        self.progress.fileDone(audio_file_in, status)
+        with self.lock:
+            job, again = self.active.pop(audio_file_in, [None, False])
+        if again:
+            # the manifest skips it if it has not changed since its conversion
+            self.changed(job.sheet.image if isinstance(job, Track) else job)
+
+
+def parseTarget(text):
+    # FORMAT:QUALITY:FOLDER (the folder may contain ':')
+    fields = text.split(':', 2)
+    if len(fields) != 3 or fields[0].lower() not in FORMAT_NAMES or fields[1].capitalize() not in ['Low', 'Medium', 'High']:
+        raise argparse.ArgumentTypeError('expected FORMAT:QUALITY:FOLDER, got ' + text)
+    codec = FORMAT_NAMES[fields[0].lower()]
+    return Target(codec, QVAL[codec][fields[1].capitalize()][0], fields[2])
+
+
+def parseJobs(text):
+    # number of parallel conversions or 'auto' (0: a coordinator that does not convert)
+    if text.lower() == 'auto':
+        return 'auto'
+    try:
+        njobs = int(text)
+    except ValueError:
+        njobs = -1
+    if njobs < 0:
+        raise argparse.ArgumentTypeError('expected a positive number or auto, got ' + text)
+    return njobs
+
+
+def parseAddressArg(text):
+    try:
+        return parseAddress(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected [HOST:]PORT, got ' + text)
+
+
+def runWorker(args):
+    # worker of a coordinator: the settings and the files come from the coordinator
+    njobs = os.cpu_count() if args.jobs == 'auto' else args.jobs
+    if njobs < 1:
+        logging.error('A worker needs at least one job')
+        return 2
+    probes = ProbeCache()
+    worker = Worker(args.connect, njobs, probes)
+
+    def stop(signum, frame):
+        if signum == signal.SIGINT and not worker.cancel.isCancelled():
+            logging.info('Stopping after the files in progress... (Ctrl-C again to stop at once)')
+            worker.cancel.cancel(drain=True)
+        else:
+            logging.info('Stopping...')
+            worker.cancel.cancel()
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    stats = worker.run()
+    probes.close()
+    profiler.report(args.profile_dump)
+    logging.info(('Stopped! ' if worker.cancel.isCancelled() else 'Done! ') + ', '.join(key + ': ' + str(value) for key, value in stats.items()))
+    if worker.connected == 0:
+        return 5
+    if worker.cancel.isCancelled():
+        return 4
+    if stats['failed'] > 0:
+        return 1
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pLACcli', description='pLACaudio conversion without GUI')
+    parser.add_argument('-s', '--source', help='folder of the lossless files')
+    parser.add_argument('-d', '--dest', help='destination folder')
+    parser.add_argument('-f', '--format', choices=sorted(FORMAT_NAMES), help='destination format')
+    parser.add_argument('-q', '--quality', choices=['low', 'medium', 'high'], default='high',
+                        help='compression quality (default: high)')
+    parser.add_argument('-t', '--target', action='append', type=parseTarget, default=[],
+                        help='extra target FORMAT:QUALITY:FOLDER converted in the same pass (repeatable)')
+    parser.add_argument('-j', '--jobs', type=parseJobs, default=os.cpu_count(),
+                        help="number of parallel conversions or 'auto' (tuned during the run)"
+                             " (default: number of CPUs, 0 for a coordinator that does not convert)")
+    parser.add_argument('-r', '--samplerate', type=int, choices=[int(f) for f in SAMPLERATES.values()],
+                        help='sample rate of the DSF files converted to a lossless format')
+    parser.add_argument('-c', '--channels', choices=sorted(CHANNELS), default='default',
+                        help='number of channels of the output files')
+    parser.add_argument('--largest-first', action='store_true',
+                        help='convert the longest files first (audio duration)')
+    parser.add_argument('--split', type=float, default=0, metavar='MINUTES',
+                        help='split the files longer than MINUTES in segments converted in parallel'
+                             ' (ALAC, WAV and AIFF outputs only, default: never)')
+    parser.add_argument('--no-dedupe', action='store_true',
+                        help='encode every copy of the same audio (default: copies are written from the first one)')
+    parser.add_argument('--stall', type=float, default=120, metavar='SECONDS',
+                        help='report the files without any progress for SECONDS (default: 120)')
+    parser.add_argument('--report', help='per-file report of the run (CSV, or JSON if the name ends with .json)')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running and convert the new or modified files of the source folder (Ctrl-C to stop)')
+    parser.add_argument('--settle', type=float, default=5.0, metavar='SECONDS',
+                        help='with --watch: time without change before a file is converted (default: 5)')
+    parser.add_argument('--serve', type=parseAddressArg, metavar='[HOST:]PORT',
+                        help='coordinator: the files are also converted by the workers connected to this port')
+    parser.add_argument('--connect', type=parseAddressArg, metavar='HOST:PORT',
+                        help='worker: convert the files of the coordinator (same paths on every host)')
+    parser.add_argument('--profile', action='store_true',
+                        help='time the stages of the run (scan, probe, spawn, ffmpeg...) and log a summary at the end')
+    parser.add_argument('--profile-dump', metavar='FILE',
+                        help='also run cProfile and write its statistics to FILE (pstats format, implies --profile)')
+    parser.add_argument('--log', default=logFile('pLACcli.log'),
+                        help="rotating log file with the debug messages and the per-file records"
+                             " (default: pLACcli.log in the cache folder, '-' for none)")
+    parser.add_argument('-v', '--verbose', action='store_true', help='debug messages on the standard error')
+    args = parser.parse_args(argv)
+
+    # standard error and rotating log file (all the messages and one record per output)
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s -> %(message)s', '%Y-%m-%d %H:%M'))
+    stream.setLevel(logging.DEBUG if args.verbose else logging.INFO)
+    startLogging([stream], None if args.log == '-' else args.log)
+    if args.profile or args.profile_dump is not None:
+        profiler.enable(cprofile=args.profile_dump is not None)
+
+    if args.connect is not None:
+        return runWorker(args)
+
+    # check the arguments
+    if args.source is None:
+        parser.error('the folder of the lossless files is required (--source)')
+    if args.jobs == 0 and args.serve is None:
+        parser.error('--jobs 0 is only possible with --serve')
+    targets = []
+    if args.format is not None or args.dest is not None:
+        if args.format is None or args.dest is None:
+            parser.error('--format and --dest go together')
+        codec = FORMAT_NAMES[args.format]
+        targets.append(Target(codec, QVAL[codec][args.quality.capitalize()][0], args.dest))
+    targets += args.target
+    if len(targets) == 0:
+        parser.error('no target: use --format and --dest or --target')
+    lossless_folder = os.path.normpath(args.source)
+    if not os.path.isdir(lossless_folder):
+        parser.error('folder of lossless files is not correctly set: ' + args.source)
+    for target in targets:
+        target.lossy_location = os.path.normpath(target.lossy_location)
+        if not os.path.isdir(target.lossy_location):
+            parser.error('destination folder is not correctly set: ' + target.lossy_location)
+    samplerate = 0
+    for key, value in SAMPLERATES.items():
+        if args.samplerate is not None and int(value) == args.samplerate:
+            samplerate = key
+    channels = CHANNELS[args.channels]
+
+    for target in targets:
+        logging.info('Target: ' + str(target))
+        target.manifest = Manifest(target.lossy_location, target.settings(samplerate, channels))
+        ntemp = target.manifest.cleanup()
+        if ntemp > 0:
+            logging.info('Temporary files of an interrupted conversion removed: ' + str(ntemp))
+
+    # the workers start with the first files found
+    jobs = JobQueue(args.largest_first)
+    njobs = os.cpu_count() if args.jobs == 'auto' else args.jobs
+    split = args.split
+    if args.serve is not None and split > 0:
+        # the segments of a file are joined by the host which converted the last one
+        logging.warning('Long files are not split in segments with --serve')
+        split = 0
+    converter = Converter(targets, lossless_folder, samplerate, channels, 60 * split, njobs)
+    if args.no_dedupe:
+        converter.dedupe = None
+    converter.probes = ProbeCache()
+    converter.activity.stall = args.stall
+    progress = Progress(converter.throughput, activity=converter.activity)
+    fileDone = progress.fileDone
+    watch = None
+    if args.watch:
+        watch = WatchQueue(jobs, converter, progress)
+        fileDone = watch.fileDone
+    # the local threads and the remote workers pull the files from the same queue
+    queue = jobs
+    coordinator = None
+    if args.serve is not None:
+        try:
+            coordinator = Coordinator(jobs, converter, args.serve, fileDone)
+        except OSError as e:
+            logging.error('Unable to listen on port ' + str(args.serve[1]) + ': ' + str(e))
+            return 2
+        coordinator.start()
+        queue = coordinator
+    if args.jobs == 'auto':
+        from governor import Governor  # psutil is only needed here
+        converter.governor = Governor(njobs, converter.throughput, activity=converter.activity)
+        converter.governor.start()
+
+    def stop(signum, frame):
+        if signum == signal.SIGINT and not converter.cancel.isCancelled():
+            logging.info('Stopping after the files in progress... (Ctrl-C again to stop at once)')
+            converter.cancel.cancel(drain=True)
+        else:
+            logging.info('Stopping...')
+            converter.cancel.cancel()
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    workers = [threading.Thread(target=convertFiles, args=(queue, converter, fileDone, i))
+               for i in range(njobs)]
+    for worker in workers:
+        worker.start()
+    ticker = threading.Thread(target=progress.tick, daemon=True)
+    ticker.start()
+    start_time = time.monotonic()
+    watcher = None
+    if watch is not None:
+        # started before the scan: no file copied in the meantime is missed
+        watcher = Watcher(lossless_folder, watch.changed, args.settle)
+        watcher.start()
+    counts = {}
+    # the files are probed (codec, duration...) in parallel before being queued
+    for audio_file, size, info in probeFiles(scanFiles(lossless_folder, counts), converter.probes, max(1, njobs)):
+        if converter.cancel.isCancelled():
+            break
+        if watch is not None and not watch.add(audio_file):
+            continue
+        seconds = audioDuration(audio_file, info)
+        jobs.put(audio_file, seconds)
+        converter.throughput.add(size, seconds)
+    converter.probes.commit()
+    nfiles = converter.throughput.total_files
+    progress.emit('scan', found=nfiles, bytes=converter.throughput.total_bytes,
+                  seconds=round(converter.throughput.total_seconds, 1), formats=counts)
+    for fmt in counts:
+        logging.info('Number of ' + fmt + ' files: ' + str(counts[fmt]))
+    logging.info('Total number of files: ' + str(nfiles))
+    logging.info('Total audio duration: %.1f h' % (converter.throughput.total_seconds / 3600))
+    if watcher is not None:
+        logging.info('Watching ' + lossless_folder + ' (Ctrl-C to stop)')
+        while not converter.cancel.isCancelled() and watcher.is_alive():
+            time.sleep(0.5)
+        if watcher.error is not None:
+            logging.error('The watch stopped on an error, the queued files are converted before exiting')
+        watcher.stop()
+        watcher.join()
+        nfiles = converter.throughput.total_files
+    jobs.close()
+    for worker in workers:
+        worker.join()
+    if coordinator is not None:
+        coordinator.wait()
+        coordinator.stop()
+    progress.stopped.set()
+    if converter.governor is not None:
+        converter.governor.stop()
+    for target in targets:
+        target.manifest.close()
+    converter.probes.close()
+    profiler.report(args.profile_dump)
+    if args.report is not None:
+        nrec = converter.telemetry.write(args.report)
+        logging.info('Report of ' + str(nrec) + ' conversions written to ' + args.report)
+
+    failures = [{'file': audio_file_in, 'exit': ret, 'errors': errors}
+                for audio_file_in, ret, errors in converter.failures]
+    progress.emit('end', elapsed=round(time.monotonic() - start_time, 3), failures=failures, **converter.stats)
+    logging.info(('Stopped! ' if converter.cancel.isCancelled() else 'Done! ') + ', '.join(key + ': ' + str(value) for key, value in converter.stats.items()))
+    if nfiles == 0 and watcher is None:
+        logging.error('No files found!')
+        return 3
+    if converter.cancel.isCancelled():
+        return 4
+    if watcher is not None and watcher.error is not None:
+        return 5
+    if converter.stats['failed'] > 0:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
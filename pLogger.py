@@ -28,15 +28,47 @@ License GNU GPL v3
 
 """
 import logging
+import threading
+import collections
 from PyQt5.QtWidgets import QPlainTextEdit
+from PyQt5.QtCore import QTimer
 
 
+# log view: the records of any thread are kept in a bounded buffer and shown by batches
+# from the GUI thread (one repaint per batch), the oldest lines of the view are dropped
 class PLogger(logging.Handler):
-    def __init__(self, parent):
+    def __init__(self, parent, lines=5000, period=200):
         super().__init__()
         self.widget = QPlainTextEdit(parent)
         self.widget.setReadOnly(True)
+        self.widget.setMaximumBlockCount(lines)
+        self.buffer = collections.deque(maxlen=lines)
+        self.buffer_lock = threading.Lock()  # not self.lock: Handler.handle holds it around emit
+        self.dropped = 0
+        self.timer = QTimer(parent)
+        self.timer.timeout.connect(self.showBatch)
+        self.timer.start(period)
 
     def emit(self, record):
-        msg = self.format(record)
-        self.widget.appendPlainText(msg)
+        try:
+            msg = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+        with self.buffer_lock:
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped += 1
+            self.buffer.append(msg)
+
+    def showBatch(self):
+        # GUI thread only (timer)
+        with self.buffer_lock:
+            if len(self.buffer) == 0:
+                return
+            lines = list(self.buffer)
+            self.buffer.clear()
+            dropped = self.dropped
+            self.dropped = 0
+        if dropped > 0:
+            lines.insert(0, '... ' + str(dropped) + ' lines not shown (see the log file)')
+        self.widget.appendPlainText('\n'.join(lines))
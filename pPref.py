@@ -28,7 +28,8 @@ License GNU GPL v3
 
 """
 import logging
-from pSettings import ChangeStyle, ShowLogger, ShowTrayIcon, Shutdown, SampleRate, Channels
+from pSettings import ChangeStyle, ShowLogger, ShowTrayIcon, Shutdown, SampleRate, Channels,\
+                      LargestFirst, Report, SplitLong, Profile, SPLIT
 from PyQt5.QtWidgets import QMainWindow, QCheckBox, QPushButton, QRadioButton, QLabel, QComboBox,\
                             QWidget, QTabWidget, QGridLayout, QVBoxLayout, QHBoxLayout
 from PyQt5.QtGui import QIcon, QFont
@@ -100,6 +101,35 @@ class Preference(QMainWindow):
         self.tray.setToolTip('Keep in the background when the main window is closed')
         tablayout1.addWidget(self.tray, 3, 1)
 
+        # checkbox (scheduling)
+        txtsched = QLabel('Scheduling : ', self)
+        txtsched.setFont(myFont)
+        tablayout1.addWidget(txtsched, 4, 0)
+        self.largest = QCheckBox('Longest files first', self)
+        self.largest.setToolTip('Convert the longest files first so that no core is left alone at the end')
+        tablayout1.addWidget(self.largest, 4, 1)
+
+        # combo (report)
+        txtreport = QLabel('Report : ', self)
+        txtreport.setFont(myFont)
+        tablayout1.addWidget(txtreport, 5, 0)
+        self.report = QComboBox(self)
+        self.report.setToolTip('Per-file statistics written in the output folder after the conversion')
+        self.report.addItems(['None', 'CSV', 'JSON'])
+        self.report.currentIndexChanged['int'].connect(self.changeReport)
+        tablayout1.addWidget(self.report, 5, 1)
+
+        # combo (profiling)
+        txtprofile = QLabel('Profiling : ', self)
+        txtprofile.setFont(myFont)
+        tablayout1.addWidget(txtprofile, 6, 0)
+        self.profile = QComboBox(self)
+        self.profile.setToolTip('Time spent in each stage of the run logged after the conversion'
+                                ' (cProfile statistics written in the output folder)')
+        self.profile.addItems(['None', 'Stages', 'Stages + cProfile'])
+        self.profile.currentIndexChanged['int'].connect(self.changeProfile)
+        tablayout1.addWidget(self.profile, 6, 1)
+
         # checkbox and combo (sample rate)
         txtsr = QLabel('User-defined sample rate (lossless DSF conversion) :', self)
         txtsr.setFont(myFont)
@@ -121,6 +151,16 @@ class Preference(QMainWindow):
         self.chn.currentIndexChanged['int'].connect(self.channels)
         tablayout2.addWidget(self.chn, 1, 1)
 
+        # combo (split long files)
+        txtsplit = QLabel('Split the long files (ALAC, WAV, AIFF outputs) :', self)
+        txtsplit.setFont(myFont)
+        tablayout2.addWidget(txtsplit, 2, 0)
+        self.splitlong = QComboBox(self)
+        self.splitlong.setToolTip('Files longer than this duration are cut in segments converted in parallel')
+        self.splitlong.addItems(['Never'] + ['> ' + str(m) + ' min' for m in SPLIT[1:]])
+        self.splitlong.currentIndexChanged['int'].connect(self.changeSplit)
+        tablayout2.addWidget(self.splitlong, 2, 1)
+
 
         # quit button
         self.btn_ok = QPushButton('OK', self)
@@ -151,9 +191,22 @@ class Preference(QMainWindow):
             self.tray.setCheckState(Qt.Qt.Unchecked)
         self.tray.stateChanged.connect(self.changeTrayIcon)
 
+        # checkbox (scheduling)
+        if self.parent().largestfirst != 0:
+            self.largest.setCheckState(Qt.Qt.Checked)
+        else:
+            self.largest.setCheckState(Qt.Qt.Unchecked)
+        self.largest.stateChanged.connect(self.changeLargestFirst)
+
         # combo (after conversion)
         self.pwoff.setCurrentIndex(self.parent().poweroff)
 
+        # combo (report)
+        self.report.setCurrentIndex(self.parent().report)
+
+        # combo (profiling)
+        self.profile.setCurrentIndex(self.parent().profile)
+
         # checkbox (sample rate)
         if self.parent().samplerate == 0:
             self.sr.setCheckState(Qt.Qt.Unchecked)
@@ -167,6 +220,9 @@ class Preference(QMainWindow):
         # combo (channels)
         self.chn.setCurrentIndex(self.parent().channels)
 
+        # combo (split long files)
+        self.splitlong.setCurrentIndex(self.parent().split)
+
         # quit button
         self.btn_ok.clicked.connect(self.pref_exit)
 
@@ -204,6 +260,31 @@ class Preference(QMainWindow):
             ShowTrayIcon(self.parent(), 0)
             logging.info('Tray icon is disabled')
 
+    @pyqtSlot()
+    def changeLargestFirst(self):
+        if self.largest.isChecked():
+            LargestFirst(self.parent(), 1)
+            logging.info('Longest files are converted first')
+        else:
+            LargestFirst(self.parent(), 0)
+            logging.info('Files are converted in the listing order')
+
+    @pyqtSlot(int)
+    def changeReport(self, value):
+        if value == 0:
+            logging.info('No report after the conversion')
+        else:
+            logging.info('A ' + self.report.currentText() + ' report is written after the conversion')
+        Report(self.parent(), value)
+
+    @pyqtSlot(int)
+    def changeProfile(self, value):
+        if value == 0:
+            logging.info('No profiling of the conversion')
+        else:
+            logging.info('The conversion is profiled (' + self.profile.currentText() + ')')
+        Profile(self.parent(), value)
+
     @pyqtSlot()
     def changeSR(self):
         if self.sr.isChecked():
@@ -245,6 +326,14 @@ class Preference(QMainWindow):
             logging.info('Audio output is stereophonic')
         Channels(self.parent(), value)
 
+    @pyqtSlot(int)
+    def changeSplit(self, value):
+        if value == 0:
+            logging.info('Long files are not split')
+        else:
+            logging.info('Files longer than ' + str(SPLIT[value]) + ' min are split in segments')
+        SplitLong(self.parent(), value)
+
     def pref_exit(self):
         self.close()
 
@@ -29,6 +29,9 @@ License GNU GPL v3
 """
 import qdarkstyle
 
+# durations (minutes) above which a file is split in segments converted in parallel (0: never)
+SPLIT = [0, 10, 20, 30, 60]
+
 
 def ChangeStyle(self, theme=0):
     self.theme = theme
@@ -77,3 +80,23 @@ def Channels(self, channel=0):
     self.channels = channel
     # save settings
     self.settings.setValue('channels', channel)
+
+def LargestFirst(self, first=0):
+    self.largestfirst = first
+    # save settings
+    self.settings.setValue('largestfirst', first)
+
+def Report(self, report=0):
+    self.report = report
+    # save settings
+    self.settings.setValue('report', report)
+
+def SplitLong(self, split=0):
+    self.split = split
+    # save settings
+    self.settings.setValue('split', split)
+
+def Profile(self, profile=0):
+    self.profile = profile
+    # save settings
+    self.settings.setValue('profile', profile)
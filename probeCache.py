@@ -0,0 +1,121 @@
+"""     _               _____                _ _
+       | |        /\   / ____|              | (_)
+  _ __ | |       /  \ | |     __ _ _   _  __| |_  ___
+ | '_ \| |      / /\ \| |    / _` | | | |/ _` | |/ _ \
+ | |_) | |____ / ____ \ |___| (_| | |_| | (_| | | (_) |
+ | .__/|______/_/    \_\_____\__,_|\__,_|\__,_|_|\___/
+ | |
+ |_|
+
+This file is part of pLAC-audio.
+
+pLAC-audio is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pLAC-audio is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pLAC-audio.  If not, see <http://www.gnu.org/licenses/>
+
+Copyright (c) 2019 Fabrice Zaoui
+
+License GNU GPL v3
+"""
+import os
+import sys
+import logging
+import sqlite3
+import threading
+from launcher import probe
+
+COLUMNS = ['codec', 'duration', 'sample_rate', 'channels', 'bits']
+
+
+def cacheFolder():
+    # per-user cache folder (the lossless folder may be read-only)
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+    elif sys.platform == 'darwin':
+        base = os.path.expanduser('~/Library/Caches')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return os.path.join(base, 'pLACaudio')
+
+
+# persistent index of the ffprobe results: a file is probed again only if its size or its
+# modification time have changed (the results of the run are also kept in memory)
+class ProbeCache:
+    def __init__(self, path=None):
+        if path is None:
+            os.makedirs(cacheFolder(), exist_ok=True)
+            path = os.path.join(cacheFolder(), 'probe.db')
+        self.lock = threading.Lock()
+        self.memory = {}
+        # shared by the processes of the user (cluster workers, GUI and CLI): write-ahead log,
+        # one short transaction per result and a wait on a lock held by another process
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        try:
+            self.db.execute('PRAGMA journal_mode=WAL')
+        except sqlite3.Error as e:
+            logging.debug('probe cache: ' + str(e))
+        self.db.execute('CREATE TABLE IF NOT EXISTS probe (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, '
+                        'codec TEXT, duration REAL, sample_rate INTEGER, channels INTEGER, bits INTEGER)')
+        self.db.commit()
+
+    def get(self, path, size, mtime):
+        path = os.path.abspath(path)
+        with self.lock:
+            entry = self.memory.get(path)
+            if entry is not None and entry[0] == size and entry[1] == mtime:
+                return entry[2]
+            try:
+                row = self.db.execute('SELECT size, mtime, ' + ', '.join(COLUMNS) + ' FROM probe WHERE path=?',
+                                      (path,)).fetchone()
+            except sqlite3.Error as e:
+                # an unreadable cache is a miss
+                logging.debug('probe cache: ' + str(e))
+                return None
+            if row is None or row[0] != size or row[1] != mtime:
+                return None
+            info = dict(zip(COLUMNS, row[2:]))
+            self.memory[path] = (size, mtime, info)
+            return info
+
+    def probe(self, path, size=None, mtime=None):
+        # codec, duration, sample rate, channels and bits of the file (None if ffprobe fails)
+        path = os.path.abspath(path)
+        if size is None or mtime is None:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+            size, mtime = stat.st_size, stat.st_mtime
+        info = self.get(path, size, mtime)
+        if info is not None:
+            return info
+        info = probe(path)
+        if info is None:
+            return None
+        with self.lock:
+            self.memory[path] = (size, mtime, info)
+            try:
+                with self.db:
+                    self.db.execute('INSERT OR REPLACE INTO probe VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                    [path, size, mtime] + [info[column] for column in COLUMNS])
+            except sqlite3.Error as e:
+                # not stored: probed again next time
+                logging.debug('probe cache: ' + str(e))
+        return info
+
+    def commit(self):
+        # every result is committed when stored
+        pass
+
+    def close(self):
+        with self.lock:
+            self.db.close()
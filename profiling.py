@@ -0,0 +1,164 @@
+"""     _               _____                _ _
+       | |        /\   / ____|              | (_)
+  _ __ | |       /  \ | |     __ _ _   _  __| |_  ___
+ | '_ \| |      / /\ \| |    / _` | | | |/ _` | |/ _ \
+ | |_) | |____ / ____ \ |___| (_| | |_| | (_| | | (_) |
+ | .__/|______/_/    \_\_____\__,_|\__,_|\__,_|_|\___/
+ | |
+ |_|
+
+This file is part of pLAC-audio.
+
+pLAC-audio is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pLAC-audio is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pLAC-audio.  If not, see <http://www.gnu.org/licenses/>
+
+Copyright (c) 2019 Fabrice Zaoui
+
+License GNU GPL v3
+
+Opt-in profiling of a run: wall time of each stage (scan, probe, outputs, spawn, ffmpeg...) summed over
+all the threads, optionally with cProfile in every worker thread. Nothing is measured until enable().
+"""
+import io
+import time
+import pstats
+import cProfile
+import logging
+import threading
+import contextlib
+
+
+# context manager doing nothing (timers of a disabled profiler)
+class NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class Timer:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Profiler:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.cprofile = False
+        self.stages = {}  # name: [calls, total seconds, longest call]
+        self.profiles = []
+        self.main = None
+        self.start = 0.0
+        self.null = NullTimer()
+
+    def enable(self, cprofile=False):
+        # the calling thread is profiled too (main thread of the run)
+        with self.lock:
+            self.enabled = True
+            self.cprofile = cprofile
+            self.stages = {}
+            self.profiles = []
+        self.start = time.perf_counter()
+        self.main = self.startProfile()
+
+    def timer(self, name):
+        # with profiler.timer('stage'): ...
+        if not self.enabled:
+            return self.null
+        return Timer(self, name)
+
+    def add(self, name, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            stage = self.stages.setdefault(name, [0, 0.0, 0.0])
+            stage[0] += 1
+            stage[1] += seconds
+            stage[2] = max(stage[2], seconds)
+
+    def startProfile(self):
+        if not self.cprofile:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # a single profiler for all the threads (Python >= 3.12): already running
+            return None
+        with self.lock:
+            self.profiles.append(profile)
+        return profile
+
+    @contextlib.contextmanager
+    def thread(self):
+        # with profiler.thread(): body of a worker thread
+        profile = self.startProfile() if self.enabled else None
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+
+    def table(self):
+        # stages by total time (the time of the threads is summed: the total may exceed the wall time)
+        wall = time.perf_counter() - self.start
+        with self.lock:
+            stages = sorted(self.stages.items(), key=lambda item: -item[1][1])
+        lines = ['%-16s %9s %11s %10s %10s' % ('stage', 'calls', 'total (s)', 'mean (ms)', 'max (ms)')]
+        for name, (calls, total, longest) in stages:
+            lines.append('%-16s %9d %11.3f %10.3f %10.1f' % (name, calls, total, 1e3 * total / calls, 1e3 * longest))
+        lines.append('%-16s %9s %11.3f' % ('wall time', '', wall))
+        return lines
+
+    def report(self, dump=None, top=25):
+        # summary table logged at the end of the run, cProfile statistics written to 'dump' (pstats format)
+        if not self.enabled:
+            return
+        if self.main is not None:
+            self.main.disable()
+        logging.info('Profile of the run:')
+        for line in self.table():
+            logging.info(line)
+        with self.lock:
+            profiles = list(self.profiles)
+            self.enabled = False
+        if len(profiles) > 0:
+            stats = pstats.Stats(profiles[0], stream=io.StringIO())
+            for profile in profiles[1:]:
+                stats.add(profile)
+            if dump is not None:
+                try:
+                    stats.dump_stats(dump)
+                    logging.info('Profile written to: ' + dump)
+                except OSError:
+                    logging.exception('Unable to write the profile')
+            stats.sort_stats('cumulative').print_stats(top)
+            for line in stats.stream.getvalue().splitlines():
+                if line.strip():
+                    logging.info(line)
+
+
+# profiler of the process (disabled by default)
+profiler = Profiler()
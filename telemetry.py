@@ -0,0 +1,231 @@
+"""     _               _____                _ _
+       | |        /\   / ____|              | (_)
+  _ __ | |       /  \ | |     __ _ _   _  __| |_  ___
+ | '_ \| |      / /\ \| |    / _` | | | |/ _` | |/ _ \
+ | |_) | |____ / ____ \ |___| (_| | |_| | (_| | | (_) |
+ | .__/|______/_/    \_\_____\__,_|\__,_|\__,_|_|\___/
+ | |
+ |_|
+
+This file is part of pLAC-audio.
+
+pLAC-audio is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pLAC-audio is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pLAC-audio.  If not, see <http://www.gnu.org/licenses/>
+
+Copyright (c) 2019 Fabrice Zaoui
+
+License GNU GPL v3
+"""
+import os
+import csv
+import json
+import math
+import time
+import threading
+
+FIELDS = ['file', 'output', 'codec', 'quality', 'path', 'worker', 'status', 'exit', 'source_size', 'output_size',
+          'duration', 'wall_time', 'realtime']
+
+
+# per-file records of a run (one for each output) written to a CSV or JSON report
+class Telemetry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = []
+
+    def record(self, **fields):
+        wall_time = fields.get('wall_time', 0.0)
+        fields['realtime'] = round(fields.get('duration', 0.0) / wall_time, 2) if wall_time > 0 else 0.0
+        with self.lock:
+            self.records.append(fields)
+
+    def write(self, path):
+        with self.lock:
+            records = list(self.records)
+        if path.lower().endswith('.json'):
+            with open(path, 'w') as f:
+                json.dump(records, f, indent=1)
+        else:
+            with open(path, 'w', newline='') as f:
+                writer = csv.DictWriter(f, FIELDS)
+                writer.writeheader()
+                writer.writerows(records)
+        return len(records)
+
+
+def formatTime(seconds):
+    h = int(seconds // 3600)
+    m = int((seconds % 3600) // 60)
+    sec = int((seconds % 3600) % 60)
+    return '%03d:%02d:%02d' % (h, m, sec)
+
+
+# throughput of a run in bytes and in audio seconds per second, smoothed by an exponentially
+# weighted moving average (time constant 'tau' in seconds, no history kept) and the estimated time left
+class Throughput:
+    def __init__(self, tau=60.0):
+        self.tau = tau
+        self.lock = threading.Lock()
+        self.total_files = 0
+        self.total_bytes = 0
+        self.total_seconds = 0.0
+        self.done_files = 0
+        self.done_bytes = 0
+        self.done_seconds = 0.0
+        self.rate_bytes = None
+        self.rate_seconds = None
+        self.start_time = time.monotonic()
+        self.last_time = self.start_time
+        self.last_bytes = 0
+        self.last_seconds = 0.0
+
+    def add(self, size, seconds=0.0):
+        # a file found by the scan (and its audio duration if probed)
+        with self.lock:
+            self.total_files += 1
+            self.total_bytes += size
+            self.total_seconds += seconds
+
+    def done(self, size, seconds=0.0):
+        # a file converted (or skipped)
+        with self.lock:
+            self.done_files += 1
+            self.done_bytes += size
+            self.done_seconds += seconds
+
+    def skip(self, size, seconds=0.0):
+        # a file already converted: out of the work of the run (no share in the rates)
+        with self.lock:
+            self.done_files += 1
+            self.total_bytes = max(0, self.total_bytes - size)
+            self.total_seconds = max(0.0, self.total_seconds - seconds)
+
+    def update(self):
+        # called on a regular basis (every second)
+        with self.lock:
+            now = time.monotonic()
+            dt = now - self.last_time
+            if dt <= 0:
+                return
+            rate_bytes = (self.done_bytes - self.last_bytes) / dt
+            rate_seconds = (self.done_seconds - self.last_seconds) / dt
+            if self.rate_bytes is None:
+                self.rate_bytes = rate_bytes
+                self.rate_seconds = rate_seconds
+            else:
+                # plain mean of the run as long as it is shorter than 'tau'
+                alpha = max(1.0 - math.exp(-dt / self.tau), dt / (now - self.start_time))
+                self.rate_bytes += alpha * (rate_bytes - self.rate_bytes)
+                self.rate_seconds += alpha * (rate_seconds - self.rate_seconds)
+            self.last_time = now
+            self.last_bytes = self.done_bytes
+            self.last_seconds = self.done_seconds
+
+    def fraction(self, partial=0):
+        # progress of the run (in bytes), 'partial': bytes of the files in progress
+        with self.lock:
+            if self.total_bytes == 0:
+                return 0.0
+            return min(1.0, (self.done_bytes + partial) / self.total_bytes)
+
+    def eta(self):
+        # seconds left (None if unknown)
+        with self.lock:
+            if not self.rate_bytes:
+                return None
+            return max(0.0, self.total_bytes - self.done_bytes) / self.rate_bytes
+
+    def status(self):
+        eta = self.eta()
+        return {'done': self.done_files, 'found': self.total_files, 'mbps': round((self.rate_bytes or 0.0) / 1e6, 2),
+                'realtime': round(self.rate_seconds or 0.0, 2), 'progress': round(100 * self.fraction(), 1),
+                'eta': None if eta is None else round(eta)}
+
+    def text(self):
+        eta = self.eta()
+        return 'speed: %.1f MB/s | %.1fx realtime | ETA %s' % ((self.rate_bytes or 0.0) / 1e6, self.rate_seconds or 0.0,
+                                                              '-' if eta is None else formatTime(eta))
+
+
+# what each worker is doing: position in the audio and speed read from the ffmpeg progress output
+# (written by the workers, read once a second by the GUI or the CLI: no message for each update)
+class Activity:
+    def __init__(self, stall=120.0):
+        self.stall = stall  # seconds without any progress before a file is reported as stalled
+        self.lock = threading.Lock()
+        self.jobs = {}
+
+    def begin(self, worker, source, size=0, seconds=0.0):
+        now = time.monotonic()
+        with self.lock:
+            self.jobs[worker] = {'file': source, 'size': size, 'duration': seconds, 'position': 0.0, 'speed': None,
+                                 'start': now, 'moved': now, 'stalled': False}
+
+    def update(self, worker, info):
+        # key=value block of 'ffmpeg -progress' (every half second)
+        try:
+            position = int(info['out_time_us']) / 1e6
+        except (KeyError, ValueError):
+            position = None
+        try:
+            speed = float(info.get('speed', '').strip().rstrip('x'))
+        except ValueError:
+            speed = None
+        with self.lock:
+            job = self.jobs.get(worker)
+            if job is None:
+                return
+            if position is not None and position != job['position']:
+                job['position'] = position
+                job['moved'] = time.monotonic()
+                job['stalled'] = False
+            job['speed'] = speed
+
+    def end(self, worker):
+        with self.lock:
+            self.jobs.pop(worker, None)
+
+    def bytes(self):
+        # share of the source bytes already converted by the files in progress
+        with self.lock:
+            return sum(int(job['size'] * min(1.0, job['position'] / job['duration']))
+                       for job in self.jobs.values() if job['duration'] > 0)
+
+    def status(self):
+        now = time.monotonic()
+        with self.lock:
+            return [{'worker': worker, 'file': job['file'], 'position': round(job['position'], 1),
+                     'progress': round(100 * min(1.0, job['position'] / job['duration']), 1) if job['duration'] > 0
+                     else None, 'speed': job['speed'], 'idle': round(now - job['moved'], 1)}
+                    for worker, job in sorted(self.jobs.items(), key=lambda item: str(item[0]))]
+
+    def stalled(self):
+        # files without progress for 'stall' seconds (each one reported once)
+        now = time.monotonic()
+        found = []
+        with self.lock:
+            for worker, job in self.jobs.items():
+                if not job['stalled'] and now - job['moved'] > self.stall:
+                    job['stalled'] = True
+                    found.append((worker, job['file'], now - job['moved']))
+        return found
+
+    def text(self):
+        # one line per worker (tooltip of the GUI)
+        lines = []
+        for job in self.status():
+            progress = '' if job['progress'] is None else ' %.0f%%' % job['progress']
+            speed = '' if job['speed'] is None else ' %.1fx' % job['speed']
+            stalled = ' (no progress for %.0f s)' % job['idle'] if job['idle'] > self.stall else ''
+            lines.append('%s: %s%s%s%s' % (job['worker'], os.path.basename(str(job['file'])), progress, speed, stalled))
+        return '\n'.join(lines)
@@ -0,0 +1,230 @@
+"""     _               _____                _ _
+       | |        /\   / ____|              | (_)
+  _ __ | |       /  \ | |     __ _ _   _  __| |_  ___
+ | '_ \| |      / /\ \| |    / _` | | | |/ _` | |/ _ \
+ | |_) | |____ / ____ \ |___| (_| | |_| | (_| | | (_) |
+ | .__/|______/_/    \_\_____\__,_|\__,_|\__,_|_|\___/
+ | |
+ |_|
+
+This file is part of pLAC-audio.
+
+pLAC-audio is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pLAC-audio is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pLAC-audio.  If not, see <http://www.gnu.org/licenses/>
+
+Copyright (c) 2019 Fabrice Zaoui
+
+License GNU GPL v3
+"""
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import logging
+import threading
+import ctypes
+import ctypes.util
+from engine import FORMATS
+
+# inotify events (linux/inotify.h)
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT = struct.Struct('iIII')
+
+
+def isWatched(name):
+    # audio files and CUE sheets
+    ext = os.path.splitext(name)[1].lower()
+    return not name.startswith('.') and (ext in FORMATS or ext == '.cue')
+
+
+class Inotify:
+    # minimal binding of the Linux inotify API (no extra module needed)
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.add_watch = libc.inotify_add_watch
+        self.add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        self.folders = {}
+
+    def watch(self, folder):
+        wd = self.add_watch(self.fd, os.fsencode(folder), MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()), folder)
+        self.folders[wd] = folder
+
+    def read(self, timeout):
+        # (folder, name, mask) of the events received before the timeout
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        data = os.read(self.fd, 65536)
+        events = []
+        offset = 0
+        while offset + EVENT.size <= len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b'\0')
+            offset += EVENT.size + length
+            if mask & IN_IGNORED:
+                self.folders.pop(wd, None)
+            elif wd in self.folders or mask & IN_Q_OVERFLOW:
+                events.append((self.folders.get(wd), os.fsdecode(name), mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+# watch of the lossless folder: each new or modified audio file is given to 'callback' once it has
+# not changed (size and modification time) for 'settle' seconds, i.e. once the copy or the rip is over
+# (inotify on Linux, else a scan of the tree every 'period' seconds)
+class Watcher(threading.Thread):
+    def __init__(self, folder, callback, settle=5.0, period=10.0):
+        threading.Thread.__init__(self, daemon=True)
+        self.folder = folder
+        self.callback = callback
+        self.settle = settle
+        self.period = period
+        self.stopped = threading.Event()
+        self.candidates = {}  # path -> (size, mtime, time of the last change)
+        self.inotify = None
+        self.snapshot = None
+        self.error = None  # exception that ended the watch
+        if sys.platform.startswith('linux'):
+            try:
+                self.inotify = Inotify()
+                self.inotify.watch(self.folder)
+                self.watchTree(self.folder, False)
+            except (OSError, AttributeError) as e:
+                logging.warning('inotify not available (' + str(e) + '), the folder is scanned every '
+                                + str(int(period)) + ' s')
+                if self.inotify is not None:
+                    self.inotify.close()
+                self.inotify = None
+        if self.inotify is None:
+            self.snapshot = self.walk()
+
+    def stop(self):
+        self.stopped.set()
+
+    def watchTree(self, folder, new):
+        # watches of a folder and its subfolders ('new': the files already there are candidates too)
+        folders = [folder]
+        while folders:
+            folder = folders.pop()
+            try:
+                # a folder removed (or out of watches) since its event: skipped
+                self.inotify.watch(folder)
+                with os.scandir(folder) as it:
+                    for entry in it:
+                        if entry.name.startswith('.'):
+                            continue
+                        if entry.is_dir():
+                            folders.append(entry.path)
+                        elif new and isWatched(entry.name):
+                            self.change(entry.path)
+            except OSError:
+                continue
+
+    def walk(self):
+        # size and modification time of the files of the tree (polling)
+        files = {}
+        folders = [self.folder]
+        while folders:
+            try:
+                with os.scandir(folders.pop()) as it:
+                    for entry in it:
+                        if entry.name.startswith('.'):
+                            continue
+                        if entry.is_dir():
+                            folders.append(entry.path)
+                        elif isWatched(entry.name):
+                            stat = entry.stat()
+                            files[entry.path] = (stat.st_size, stat.st_mtime)
+            except OSError:
+                continue
+        return files
+
+    def change(self, path):
+        # a file written: its settle time starts again
+        self.candidates[path] = (None, None, time.monotonic())
+
+    def check(self):
+        # the files unchanged for 'settle' seconds are given to the callback
+        now = time.monotonic()
+        for path, (size, mtime, since) in list(self.candidates.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self.candidates[path]
+                continue
+            if (stat.st_size, stat.st_mtime) != (size, mtime):
+                self.candidates[path] = (stat.st_size, stat.st_mtime, now)
+            elif now - since >= self.settle:
+                del self.candidates[path]
+                try:
+                    self.callback(path)
+                except Exception:
+                    logging.exception('New file not queued: ' + path)
+
+    def run(self):
+        try:
+            self.loop()
+        except Exception as e:
+            # the caller sees the thread ended with 'error' set
+            logging.exception('Watch of ' + self.folder + ' stopped')
+            self.error = e
+        finally:
+            if self.inotify is not None:
+                self.inotify.close()
+
+    def loop(self):
+        last = time.monotonic()
+        while not self.stopped.is_set():
+            if self.inotify is not None:
+                try:
+                    events = self.inotify.read(1.0)
+                except OSError as e:
+                    if e.errno == errno.EINTR:
+                        continue
+                    raise
+                for folder, name, mask in events:
+                    if mask & IN_Q_OVERFLOW:
+                        # events lost: everything is checked again (the manifests skip the converted files)
+                        logging.warning('Too many changes at once, the whole folder is checked')
+                        self.watchTree(self.folder, True)
+                    elif mask & IN_ISDIR:
+                        if mask & (IN_CREATE | IN_MOVED_TO) and not name.startswith('.'):
+                            self.watchTree(os.path.join(folder, name), True)
+                    elif isWatched(name):
+                        self.change(os.path.join(folder, name))
+            else:
+                self.stopped.wait(1.0)
+                if time.monotonic() - last >= self.period:
+                    last = time.monotonic()
+                    snapshot = self.walk()
+                    for path, state in snapshot.items():
+                        if self.snapshot.get(path) != state:
+                            self.change(path)
+                    self.snapshot = snapshot
+            self.check()